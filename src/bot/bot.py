@@ -13,7 +13,12 @@ from handlers.handlers import (
     img_handler,
     today_handler,
     clear_handler,
+    reload_rag_handler,
+    rag_stats_handler,
+    scope_handler,
 )
+from rag.search import start_rag_init
+from utils.startup import STARTUP
 from utils.utils import create_initial_folders
 
 
@@ -63,7 +68,8 @@ async def start_bot() -> None:
     create_initial_folders()
 
     try:
-        await client.start(bot_token=bot_token)
+        with STARTUP.stage("telegram_connect"):
+            await client.start(bot_token=bot_token)
     except UnauthorizedError:
         logging.critical(
             "❌ Telegram отказал в доступе. Проверь BOTTOKEN / API_ID / API_HASH"
@@ -78,4 +84,13 @@ async def start_bot() -> None:
     client.add_event_handler(img_handler)
     client.add_event_handler(today_handler)
     client.add_event_handler(clear_handler)
+    client.add_event_handler(reload_rag_handler)
+    client.add_event_handler(rag_stats_handler)
+    client.add_event_handler(scope_handler)
     client.add_event_handler(universal_handler)
+
+    # Модель и FAISS грузятся в фоне: бот уже отвечает, RAG подключится,
+    # как только будет готов (см. rag.search.wait_ready)
+    start_rag_init()
+
+    logging.info(f"⏱ Bot online: {STARTUP.report()}")
@@ -1,12 +1,9 @@
 import base64
 import logging
 
-from openai import OpenAI
-
+from functions.openai_client import client, openai_slot
 from utils.utils import model, sys_mess
 
-client = OpenAI()
-
 
 # ==============================
 # WEB SEARCH (реальный интернет-поиск)
@@ -34,12 +31,13 @@ async def search(query: str) -> str:
     )
 
     try:
-        response = client.responses.create(
-            model=model,
-            input=prompt,
-            tools=[{"type": "web_search"}],
-            max_output_tokens=800,
-        )
+        async with openai_slot("search"):
+            response = await client.responses.create(
+                model=model,
+                input=prompt,
+                tools=[{"type": "web_search"}],
+                max_output_tokens=800,
+            )
 
         text_parts = []
 
@@ -59,15 +57,16 @@ async def search(query: str) -> str:
         logging.exception("SEARCH ERROR")
 
         try:
-            completion = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": sys_mess},
-                    {"role": "user", "content": query}
-                ],
-                max_tokens=800,
-                temperature=0.4,
-            )
+            async with openai_slot("chat"):
+                completion = await client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": sys_mess},
+                        {"role": "user", "content": query}
+                    ],
+                    max_tokens=800,
+                    temperature=0.4,
+                )
 
             return completion.choices[0].message.content.strip()
 
@@ -85,11 +84,12 @@ async def generate_image(prompt: str) -> bytes:
         prompt = "Домашнее животное в фирменном стиле «Четыре Лапы»"
 
     try:
-        result = client.images.generate(
-            model="gpt-image-1",
-            prompt=prompt,
-            size="1024x1024",
-        )
+        async with openai_slot("image"):
+            result = await client.images.generate(
+                model="gpt-image-1",
+                prompt=prompt,
+                size="1024x1024",
+            )
 
         image_b64 = result.data[0].b64_json
         return base64.b64decode(image_b64)
@@ -112,25 +112,26 @@ async def analyze_image_with_gpt(
 
         prompt = user_prompt or "Опиши, пожалуйста, это изображение."
 
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": sys_mess},
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_b64}"
+        async with openai_slot("vision"):
+            response = await client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": sys_mess},
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": prompt},
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:image/jpeg;base64,{image_b64}"
+                                },
                             },
-                        },
-                    ],
-                },
-            ],
-            max_tokens=500,
-        )
+                        ],
+                    },
+                ],
+                max_tokens=500,
+            )
 
         return response.choices[0].message.content.strip()
 
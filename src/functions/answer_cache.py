@@ -0,0 +1,141 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.utils import sys_mess
+
+
+# ===============================================================
+# SETTINGS
+# ===============================================================
+
+# Кэш ответов включается явно: он экономит запросы к OpenAI
+# на частых вопросах по базе знаний, но отвечает «как в прошлый раз».
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "0") == "1"
+
+# Минимальная косинусная близость вопросов, чтобы считать их одинаковыми
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "21600"))
+
+# Сколько разных формулировок храним на один набор найденных чанков
+ANSWER_CACHE_PER_KEY = 8
+
+# Версия системного промпта: при его изменении старые ответы не используются
+PROMPT_VERSION = hashlib.sha1(sys_mess.encode("utf-8")).hexdigest()[:12]
+
+
+CacheKey = Tuple[str, Any, Tuple[Any, ...]]
+
+
+class SemanticAnswerCache:
+    """
+    Кэш готовых ответов модели на RAG-вопросы.
+
+    Ключ — (версия системного промпта, версия индекса, id найденных чанков).
+    id чанка стабилен между сборками (файл, страница, раздел, смещение),
+    поэтому после правки документа и горячей перезагрузки тот же id
+    указывает на новый текст. Версия индекса, на которой найдены чанки,
+    входит в ключ, чтобы не отдавать ответ по старому тексту; ответы
+    прошлой версии вытесняются по LRU/TTL.
+    Внутри ключа ответ ищется по близости эмбеддинга вопроса:
+    совпадение засчитывается, если косинус ≥ threshold.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 256,
+        ttl: float = 21600.0,
+        threshold: float = 0.95,
+    ):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self.threshold = threshold
+
+        self._buckets: "OrderedDict[CacheKey, List[Tuple[float, np.ndarray, str]]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(version: Any, chunk_ids: Sequence[Any]) -> CacheKey:
+        return PROMPT_VERSION, version, tuple(chunk_ids)
+
+    @staticmethod
+    def _normalize(vec: Any) -> np.ndarray:
+        v = np.asarray(vec, dtype="float32").reshape(-1)
+        norm = float(np.linalg.norm(v))
+        return v / norm if norm else v
+
+    def lookup(self, vec: Any, version: Any, chunk_ids: Sequence[Any]) -> Optional[str]:
+        key = self.make_key(version, chunk_ids)
+        q = self._normalize(vec)
+        now = time.monotonic()
+
+        with self._lock:
+            entries = self._buckets.get(key)
+            if entries:
+                alive = [e for e in entries if e[0] >= now]
+                self._size -= len(entries) - len(alive)
+
+                best: Optional[str] = None
+                best_sim = self.threshold
+                for _, v, answer in alive:
+                    sim = float(np.dot(q, v))
+                    if sim >= best_sim:
+                        best, best_sim = answer, sim
+
+                if alive:
+                    self._buckets[key] = alive
+                    self._buckets.move_to_end(key)
+                else:
+                    del self._buckets[key]
+
+                if best is not None:
+                    self.hits += 1
+                    return best
+
+            self.misses += 1
+            return None
+
+    def store(self, vec: Any, version: Any, chunk_ids: Sequence[Any], answer: str) -> None:
+        key = self.make_key(version, chunk_ids)
+        entry = (time.monotonic() + self.ttl, self._normalize(vec), answer)
+
+        with self._lock:
+            entries = self._buckets.setdefault(key, [])
+            entries.append(entry)
+            self._size += 1
+            if len(entries) > ANSWER_CACHE_PER_KEY:
+                entries.pop(0)
+                self._size -= 1
+            self._buckets.move_to_end(key)
+
+            while self._size > self.maxsize and self._buckets:
+                _, evicted = self._buckets.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "enabled": ANSWER_CACHE_ENABLED,
+            "size": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+ANSWER_CACHE = SemanticAnswerCache(
+    maxsize=ANSWER_CACHE_SIZE,
+    ttl=ANSWER_CACHE_TTL,
+    threshold=ANSWER_CACHE_THRESHOLD,
+)
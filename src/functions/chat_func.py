@@ -1,33 +1,67 @@
+import asyncio
 import json
 import logging
+import os
+import re
+import time
 from pathlib import Path
 from typing import List, Tuple, Dict, Any, Optional
 
-from openai import OpenAI
+from telethon.errors import FloodWaitError, MessageNotModifiedError
 from telethon.events import NewMessage
 
 from utils.utils import (
     model,
     max_token,
     read_existing_conversation,
+    append_messages,
+    save_session_state,
+    compact_conversation,
     num_tokens_from_messages,
-    sys_mess
 )
+from utils.store import SUMMARY_PREFIX
 
 from functions.additional_func import search as web_search
-from rag.search import search as rag_search
+from functions.answer_cache import ANSWER_CACHE, ANSWER_CACHE_ENABLED
+from functions.openai_client import client, openai_slot
+from functions.prompt_builder import build_prompt, is_summary
+from rag.cache import TTLCache, normalize_query
+from rag.scope import Scope, extract_scope_hint
+from rag.search import (
+    RagNotReady,
+    aembed,
+    asearch as rag_search,
+    departments as rag_departments,
+    index_version,
+)
 
-client = OpenAI()
 Prompt = List[dict]
 
 # ===============================================================
 # SETTINGS
 # ===============================================================
 
-WINDOW_SIZE = 12
 SUMMARY_MAX_TOKENS = 300
 RESPONSE_MAX_TOKENS = 800
 
+# Фоновое резюме запускается, когда реплики диалога занимают больше
+# SUMMARY_SOFT_LIMIT токенов; последние SUMMARY_KEEP_RECENT реплик не сворачиваем
+SUMMARY_SOFT_LIMIT = int(max_token * 0.75)
+SUMMARY_KEEP_RECENT = 4
+
+# Общий бюджет запроса к модели: промпт + зарезервированный ответ
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+# Из него на сам промпт остаётся:
+PROMPT_INPUT_BUDGET = PROMPT_TOKEN_BUDGET - RESPONSE_MAX_TOKENS
+
+# Потоковый ответ: одно сообщение в Telegram, которое дописывается по мере генерации
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "1") == "1"
+# Не чаще одного редактирования в N секунд (лимиты Telegram на edit)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+# Лимит Telegram — 4096 символов, оставляем запас под курсор
+STREAM_MESSAGE_LIMIT = 4000
+STREAM_CURSOR = " ▌"
+
 WAIT_WEB_CONFIRM_STATE = "__WAIT_WEB_SEARCH_CONFIRM__"
 
 YES_WORDS = {"да", "давай", "ага", "ищи", "найди", "ок"}
@@ -52,24 +86,25 @@ BASE_PROJECT_DIR = Path(__file__).resolve().parents[2]
 RAG_WARNING_TEXT = (
     "⚠️ Не смог получить доступ к базе знаний, но продолжаю отвечать как ассистент."
 )
-RAG_WARNING_PENDING = False
+RAG_LOADING_TEXT = (
+    "⏳ База знаний ещё загружается после перезапуска — этот ответ без неё."
+)
+# Текст предупреждения, которое добавится к следующему ответу
+RAG_WARNING_PENDING: Optional[str] = None
+
+# Готовые (отформатированные) RAG-контексты для частых вопросов
+RAG_PAYLOAD_CACHE = TTLCache(maxsize=512, ttl=3600)
+
+# Ключ кэша ответов: (текст вопроса, версия индекса, id найденных чанков).
+# Передаётся от start_and_check к ответу явно, а не через общий словарь
+# по chat_key: в группе несколько человек спрашивают в одном чате.
+AnswerKey = Tuple[str, Any, Tuple[Any, ...]]
 
 
 # ===============================================================
 # HELPERS
 # ===============================================================
 
-def trim_prompt_window(prompt: Prompt) -> Prompt:
-    system_msgs = [m for m in prompt if m["role"] == "system"]
-    dialog_msgs = [m for m in prompt if m["role"] != "system"]
-
-    if len(dialog_msgs) <= WINDOW_SIZE:
-        return prompt
-
-    dialog_msgs = dialog_msgs[-WINDOW_SIZE:]
-    return system_msgs + dialog_msgs
-
-
 def should_keep_message(text: str) -> bool:
     if not text:
         return False
@@ -89,12 +124,28 @@ def should_keep_message(text: str) -> bool:
     return t not in trash
 
 
+def _has_phrase(text: str, phrases) -> bool:
+    # целыми словами: «да» не должно находиться в «когда»
+    words = " ".join(re.findall(r"\w+", text.lower()))
+    return any(re.search(rf"\b{re.escape(p)}\b", words) for p in phrases)
+
+
 def is_affirmative(text: str) -> bool:
-    return any(w in text.lower() for w in YES_WORDS)
+    return _has_phrase(text, YES_WORDS)
 
 
 def is_negative(text: str) -> bool:
-    return any(w in text.lower() for w in NO_WORDS)
+    return _has_phrase(text, NO_WORDS)
+
+
+def direct_reply(prompt: Prompt) -> Optional[str]:
+    """
+    Ответ, который start_and_check уже подготовил сам (уточнение, итог
+    веб-поиска): последняя реплика — ассистента, модель звать не нужно.
+    """
+    if prompt and prompt[-1].get("role") == "assistant":
+        return prompt[-1].get("content")
+    return None
 
 
 def request_documents(text: str) -> bool:
@@ -128,11 +179,22 @@ def _format_rag_chunks(
         source_file = ch.get("source_file") or ch.get("source")
         page = ch.get("page")
 
-        snippet = text[:800]
+        # чанки и так в бюджете модели (rag/chunking.py); обрезаем только
+        # старые крупные чанки, собранные до общего чанкера
+        snippet = text[:1200]
         header = f"[{rank}] Источник: {source_file}"
         if page:
             header += f", стр. {page}"
 
+        # тот же текст в других файлах (rag/dedup.py); файлом пользователю
+        # уходит только первый, остальные — для ссылки в ответе
+        also = sorted({
+            c.get("source_file") or c.get("source")
+            for c in ch.get("copies") or []
+        } - {None, "", source_file})
+        if also:
+            header += f" (также: {', '.join(also[:3])}{' и др.' if len(also) > 3 else ''})"
+
         block = f"{header}\n{snippet}"
 
         if total_len + len(block) > max_chars:
@@ -169,11 +231,31 @@ def _build_sources_hint(sources: List[Dict[str, Any]]) -> str:
     return "\n".join(lines)
 
 
-def try_rag(query: str) -> Optional[Dict[str, Any]]:
+def rag_scope_for(session: dict, text: str) -> Tuple[str, Optional[Scope]]:
+    """
+    Область поиска для вопроса: хэштег отдела в тексте (#касса) важнее
+    отдела, выбранного командой /scope. Возвращает (запрос, область).
+    """
+    query, scope = text, None
+    # без «#» хэштега отдела в тексте нет — список отделов не нужен
+    if "#" in text:
+        query, scope = extract_scope_hint(text, rag_departments())
+    if scope is None and session.get("rag_scope"):
+        scope = Scope(department=session["rag_scope"])
+    # в сообщении был только хэштег — ищем по исходному тексту
+    return query or text, scope
+
+
+async def try_rag(query: str, scope: Optional[Scope] = None) -> Optional[Dict[str, Any]]:
     global RAG_WARNING_PENDING
 
     try:
-        chunks = rag_search(query)
+        cache_key = (index_version(), normalize_query(query), scope)
+        cached = RAG_PAYLOAD_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
+
+        chunks = await rag_search(query, scope=scope)
 
         if not chunks:
             return None
@@ -182,14 +264,26 @@ def try_rag(query: str) -> Optional[Dict[str, Any]]:
         if not formatted:
             return None
 
-        return {
+        payload = {
             "formatted": formatted,
             "sources": sources,
+            "chunk_ids": tuple(ch.get("id") for ch in chunks),
+            # id чанка стабилен (файл, страница, раздел, смещение), а текст под ним
+            # после перезагрузки мог измениться — кэш ответов различает версии индекса
+            "index_version": cache_key[0],
         }
+        RAG_PAYLOAD_CACHE.set(cache_key, payload)
+
+        return payload
+
+    except RagNotReady:
+        logging.info("RAG is still loading, answering without it")
+        RAG_WARNING_PENDING = RAG_LOADING_TEXT
+        return None
 
     except Exception:
         logging.exception("RAG SEARCH ERROR")
-        RAG_WARNING_PENDING = True
+        RAG_WARNING_PENDING = RAG_WARNING_TEXT
         return None
 
 
@@ -197,16 +291,33 @@ def try_rag(query: str) -> Optional[Dict[str, Any]]:
 # CHAT
 # ===============================================================
 
+def _build(
+    history: Prompt,
+    required: Prompt,
+    rag_msg: Optional[dict] = None,
+) -> Tuple[Prompt, int]:
+    return build_prompt(
+        history,
+        required,
+        rag_msg,
+        budget=PROMPT_INPUT_BUDGET,
+        history_budget=max_token,
+    )
+
+
 async def start_and_check(
     event: NewMessage,
     message: str,
     chat_id: int,
-) -> Tuple[dict, str, Prompt]:
-
-    session, filename, prompt = read_existing_conversation(str(chat_id))
+) -> Tuple[dict, str, Prompt, Optional[AnswerKey]]:
+    """
+    Готовит промпт для ответа. Возвращает (session, chat_key, prompt,
+    answer_key); answer_key — ключ кэша ответов для этого вопроса или None,
+    его нужно передать в get_openai_response / stream_openai_response.
+    """
 
-    if not any(m["role"] == "system" for m in prompt):
-        prompt.insert(0, {"role": "system", "content": sys_mess})
+    session, chat_key, history = read_existing_conversation(str(chat_id))
+    answer_key: Optional[AnswerKey] = None
 
     text = message.strip()
 
@@ -219,7 +330,7 @@ async def start_and_check(
         sources = session.get("last_rag_sources", [])
 
         if not sources:
-            return session, filename, [
+            return session, chat_key, [
                 {
                     "role": "assistant",
                     "content": (
@@ -227,7 +338,7 @@ async def start_and_check(
                         "Сначала задайте вопрос, чтобы я смог найти нужную инструкцию."
                     ),
                 }
-            ]
+            ], None
 
         attachments = []
         for s in sources:
@@ -240,12 +351,12 @@ async def start_and_check(
                 attachments.append(full_path)
 
         if not attachments:
-            return session, filename, [
+            return session, chat_key, [
                 {
                     "role": "assistant",
                     "content": "Не удалось найти файлы документов на сервере.",
                 }
-            ]
+            ], None
 
         for f in attachments:
             await event.client.send_file(
@@ -254,13 +365,38 @@ async def start_and_check(
                 caption=f"Источник: {f.name}",
             )
 
-        return session, filename, []
+        return session, chat_key, [], None
+
+    user_msg = {"role": "user", "content": text}
+
+    # ===================================================
+    # WEB SEARCH CONFIRMATION
+    # ===================================================
+
+    if session.get("state") == WAIT_WEB_CONFIRM_STATE:
+        session["state"] = None
+        reply = None
+
+        if is_negative(text):
+            reply = "Хорошо, не ищу. Задайте другой вопрос."
+        elif is_affirmative(text) and session.get("last_rag_query"):
+            reply = await web_search(session["last_rag_query"])
+
+        if reply is not None:
+            answer_msg = {"role": "assistant", "content": reply}
+            prompt, _ = _build(history, [user_msg, answer_msg])
+            append_messages(chat_key, [user_msg, answer_msg])
+            save_session_state(chat_key, session)
+            return session, chat_key, prompt, answer_key
+
+        # не «да» и не «нет» — это уже новый вопрос
 
     # ===================================================
     # NORMAL QUESTION
     # ===================================================
 
-    rag_payload = try_rag(text)
+    rag_query, rag_scope = rag_scope_for(session, text)
+    rag_payload = await try_rag(rag_query, rag_scope)
 
     if rag_payload:
 
@@ -286,131 +422,391 @@ async def start_and_check(
                 f"{sources_hint}"
             )
 
-        prompt.insert(1, {"role": "system", "content": system_content})
-        prompt.append({"role": "user", "content": text})
+        # RAG-контекст нужен только на этот ход и в историю не сохраняется
+        rag_msg = {"role": "system", "content": system_content}
+        prompt, dropped = _build(history, [user_msg], rag_msg)
+
+        # Личные диалоги в кэш ответов не попадают и из него не читают
+        if ANSWER_CACHE_ENABLED and not event.is_private:
+            answer_key = (
+                text,
+                rag_payload["index_version"],
+                rag_payload["chunk_ids"],
+            )
 
     else:
         session["state"] = WAIT_WEB_CONFIRM_STATE
         session["last_rag_query"] = text
 
-        prompt.append(
-            {
-                "role": "assistant",
-                "content": (
-                    "Во внутренней базе знаний нет точной информации по этому вопросу.\n"
-                    "Искать ответ в интернете?"
-                ),
-            }
-        )
-
-        save_session(filename, session, prompt)
-        return session, filename, prompt
-
-    prompt = trim_prompt_window(prompt)
-
-    tokens = num_tokens_from_messages(prompt)
+        where = f"В базе знаний ({rag_scope.label()})" if rag_scope else "Во внутренней базе знаний"
+        confirm_msg = {
+            "role": "assistant",
+            "content": (
+                f"{where} нет точной информации по этому вопросу.\n"
+                "Искать ответ в интернете?"
+            ),
+        }
+        # ответ готов без модели: обработчик отправит его как есть (direct_reply)
+        prompt, _ = _build(history, [user_msg, confirm_msg])
 
-    if tokens > max_token - 500:
-        await create_summary_and_reset(prompt, filename)
-        session, filename, prompt = read_existing_conversation(str(chat_id))
+        append_messages(chat_key, [user_msg, confirm_msg])
+        save_session_state(chat_key, session)
+        return session, chat_key, prompt, answer_key
 
-        if not any(m["role"] == "system" for m in prompt):
-            prompt.insert(0, {"role": "system", "content": sys_mess})
+    if dropped:
+        # Старые реплики не влезли в бюджет — свернём их в резюме после ответа
+        _SUMMARY_REQUESTED.add(chat_key)
 
-        prompt.append({"role": "user", "content": text})
+    append_messages(chat_key, [user_msg])
+    save_session_state(chat_key, session)
 
-    return session, filename, prompt
+    return session, chat_key, prompt, answer_key
 
 
 # ===============================================================
 # SUMMARY
 # ===============================================================
 
-async def create_summary_and_reset(prompt: Prompt, filename: str):
+# Чаты, для которых резюме уже считается / нужно посчитать
+_SUMMARY_RUNNING: set = set()
+_SUMMARY_REQUESTED: set = set()
+
+
+async def summarize_history(chat_key: str):
+    """
+    Сворачивает старые реплики диалога в резюме.
+
+    Резюме инкрементальное: прошлое резюме + новые реплики → новое резюме.
+    Последние SUMMARY_KEEP_RECENT реплик остаются как есть, а всё,
+    что пришло в чат, пока модель считала резюме, не теряется
+    (см. compact_conversation).
+    """
     try:
-        dialog_only = [m for m in prompt if m["role"] != "system"]
+        _, _, history = read_existing_conversation(chat_key)
+
+        summaries = [m for m in history if is_summary(m)]
+        dialog = [m for m in history if m["role"] != "system"]
+
+        to_fold = dialog[:-SUMMARY_KEEP_RECENT]
+        if not to_fold:
+            return
+
+        previous = "\n".join(
+            m["content"][len(SUMMARY_PREFIX):].strip() for m in summaries
+        )
 
         summary_prompt = [
             {
                 "role": "system",
-                "content": "Сожми диалог в краткое резюме из 3–5 предложений.",
+                "content": (
+                    "Сожми диалог в краткое резюме из 3–5 предложений. "
+                    "Если дано прошлое резюме — дополни его новыми фактами, "
+                    "не теряя важного из прошлого."
+                ),
+            },
+            {
+                "role": "user",
+                "content": json.dumps(
+                    {"previous_summary": previous, "dialog": to_fold},
+                    ensure_ascii=False,
+                ),
             },
-            {"role": "user", "content": json.dumps(dialog_only, ensure_ascii=False)},
         ]
 
-        completion = client.chat.completions.create(
-            model=model,
-            messages=summary_prompt,
-            max_tokens=SUMMARY_MAX_TOKENS,
-            temperature=0.2,
-        )
+        async with openai_slot("chat"):
+            completion = await client.chat.completions.create(
+                model=model,
+                messages=summary_prompt,
+                max_tokens=SUMMARY_MAX_TOKENS,
+                temperature=0.2,
+            )
 
         summary = completion.choices[0].message.content.strip()
 
-        new_prompt = [
-            {"role": "system", "content": sys_mess},
-            {"role": "system", "content": f"Резюме прошлого диалога: {summary}"},
-        ]
-
-        save_session(filename, {"messages": new_prompt}, new_prompt)
+        compacted = compact_conversation(
+            chat_key,
+            summaries + to_fold,
+            [{"role": "system", "content": f"{SUMMARY_PREFIX} {summary}"}],
+        )
+        if not compacted:
+            logging.info(f"SUMMARY SKIPPED: history of {chat_key} changed")
 
     except Exception as e:
         logging.error(f"SUMMARY ERROR: {e}")
 
 
+def schedule_summary(chat_key: str, history: Prompt):
+    """
+    Запускает резюме в фоне, если история перевалила за мягкий порог
+    или на прошлом ходе не поместилась в бюджет промпта.
+    Основной запрос пользователя резюме никогда не ждёт.
+    """
+    if chat_key in _SUMMARY_RUNNING:
+        return
+
+    dialog = [m for m in history if m["role"] != "system"]
+    requested = chat_key in _SUMMARY_REQUESTED
+    if not requested and num_tokens_from_messages(dialog) <= SUMMARY_SOFT_LIMIT:
+        return
+
+    _SUMMARY_REQUESTED.discard(chat_key)
+    _SUMMARY_RUNNING.add(chat_key)
+
+    async def _run():
+        try:
+            await summarize_history(chat_key)
+        finally:
+            _SUMMARY_RUNNING.discard(chat_key)
+
+    asyncio.get_running_loop().create_task(_run())
+
+
 # ===============================================================
 # SAVE + OPENAI RESPONSE + SENDER
 # ===============================================================
 
-def save_session(filename: str, session: dict, prompt: Prompt):
+async def _lookup_cached_answer(
+    cache_key: Optional[AnswerKey],
+) -> Tuple[Optional[str], Any]:
+    query_vec = None
+    answer = None
+
+    if cache_key:
+        try:
+            query_vec = await aembed(cache_key[0])
+            answer = ANSWER_CACHE.lookup(query_vec, *cache_key[1:])
+        except Exception:
+            logging.exception("ANSWER CACHE ERROR")
+
+    return answer, query_vec
+
+
+def _pop_rag_warning() -> str:
+    global RAG_WARNING_PENDING
+
+    if not RAG_WARNING_PENDING:
+        return ""
+
+    text, RAG_WARNING_PENDING = RAG_WARNING_PENDING, None
+    return f"{text}\n\n"
+
+
+def _save_answer(chat_key: str, prompt: Prompt, answer: str):
+    answer_msg = {"role": "assistant", "content": answer}
+    prompt.append(answer_msg)
+
     try:
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(
-                {
-                    **session,
-                    "messages": prompt,
-                },
-                f,
-                ensure_ascii=False,
-                indent=2,
-            )
+        append_messages(chat_key, [answer_msg])
     except Exception as e:
         logging.error(f"SAVE SESSION ERROR: {e}")
 
+    schedule_summary(chat_key, prompt)
+
 
 async def get_openai_response(
     session: dict,
     prompt: Prompt,
-    filename: str,
+    chat_key: str,
+    cache_key: Optional[AnswerKey] = None,
 ) -> str:
 
-    global RAG_WARNING_PENDING
-
     if not prompt:
         return "Пожалуйста, уточните ваш вопрос."
 
-    prompt = trim_prompt_window(prompt)
+    answer, query_vec = await _lookup_cached_answer(cache_key)
+
+    if answer is None:
+        try:
+            async with openai_slot("chat"):
+                completion = await client.chat.completions.create(
+                    model=model,
+                    messages=prompt,
+                    max_tokens=RESPONSE_MAX_TOKENS,
+                    temperature=0.3,
+                )
+
+            answer = (completion.choices[0].message.content or "").strip()
+
+            if query_vec is not None and answer:
+                ANSWER_CACHE.store(query_vec, *cache_key[1:], answer)
+
+        except Exception as e:
+            logging.exception("OPENAI CHAT ERROR")
+            answer = f"⚠️ Ошибка при обращении к языковой модели: {e}"
+
+    answer = _pop_rag_warning() + answer
+
+    _save_answer(chat_key, prompt, answer)
+
+    return answer
+
+
+# ===============================================================
+# STREAMING
+# ===============================================================
+
+class _TelegramStreamer:
+    """
+    Показывает ответ модели по мере генерации, редактируя одно сообщение.
+
+    Редактирование — не чаще STREAM_EDIT_INTERVAL; при FloodWait ждём
+    столько, сколько попросил Telegram. Если текст перерастает лимит
+    сообщения, текущее сообщение фиксируется и начинается следующее.
+    """
+
+    def __init__(self, event: NewMessage):
+        self.event = event
+        self.text = ""
+        self._offset = 0          # начало текста текущего сообщения
+        self._message = None
+        self._shown = ""
+        self._next_edit = 0.0
+
+    async def _show(self, text: str):
+        if text == self._shown:
+            return
+
+        try:
+            if self._message is None:
+                self._message = await self.event.respond(text, link_preview=False)
+            else:
+                await self._message.edit(text, link_preview=False)
+            self._shown = text
+        except MessageNotModifiedError:
+            self._shown = text
+        except FloodWaitError as e:
+            self._next_edit = time.monotonic() + e.seconds
+
+    async def _commit(self, text: str):
+        """
+        Окончательный текст текущего сообщения. В отличие от _show,
+        при FloodWait ждёт и повторяет: этот текст больше не обновится.
+        """
+        for attempt in range(3):
+            try:
+                if self._message is None:
+                    self._message = await self.event.respond(text, link_preview=False)
+                elif text != self._shown:
+                    await self._message.edit(text, link_preview=False)
+                self._shown = text
+                return
+            except MessageNotModifiedError:
+                self._shown = text
+                return
+            except FloodWaitError as e:
+                await asyncio.sleep(e.seconds)
+            except Exception:
+                logging.exception("TELEGRAM STREAM FINISH ERROR")
+                self._message = await self.event.reply(text)
+                self._shown = text
+                return
+
+    async def _roll_over(self):
+        # фиксируем заполненное сообщение и начинаем новое
+        while len(self.text) - self._offset > STREAM_MESSAGE_LIMIT:
+            part = self.text[self._offset:self._offset + STREAM_MESSAGE_LIMIT]
+            cut = part.rfind("\n")
+            if cut <= 0:
+                cut = len(part)
+
+            await self._commit(part[:cut].strip())
+
+            self._offset += cut
+            self._message = None
+            self._shown = ""
+
+    async def feed(self, delta: str):
+        self.text += delta
+
+        if len(self.text) - self._offset > STREAM_MESSAGE_LIMIT:
+            await self._roll_over()
+
+        now = time.monotonic()
+        if now < self._next_edit:
+            return
+
+        current = self.text[self._offset:].strip()
+        if not current:
+            return
+
+        self._next_edit = now + STREAM_EDIT_INTERVAL
+        await self._show(current + STREAM_CURSOR)
+
+    async def finish(self, final_text: Optional[str] = None):
+        """Финальное редактирование точным текстом (без курсора)."""
+        if final_text is not None:
+            # ответ подменили (например, ошибкой) — показываем его целиком
+            self.text = final_text
+            self._offset = 0
+            self._shown = ""
+
+        await self._roll_over()
+
+        current = self.text[self._offset:].strip() or "Пустой ответ."
+        await self._commit(current)
+
+
+async def stream_openai_response(
+    event: NewMessage,
+    session: dict,
+    prompt: Prompt,
+    chat_key: str,
+    cache_key: Optional[AnswerKey] = None,
+) -> str:
+    """
+    Как get_openai_response, но ответ сразу отправляется в чат
+    и дописывается по мере генерации (stream=True).
+    """
+
+    if not prompt:
+        answer = "Пожалуйста, уточните ваш вопрос."
+        await process_and_send_mess(event, answer)
+        return answer
+
+    answer, query_vec = await _lookup_cached_answer(cache_key)
+    prefix = _pop_rag_warning()
+
+    if answer is not None:
+        answer = prefix + answer
+        await process_and_send_mess(event, answer)
+        _save_answer(chat_key, prompt, answer)
+        return answer
+
+    streamer = _TelegramStreamer(event)
+    if prefix:
+        await streamer.feed(prefix)
 
     try:
-        completion = client.chat.completions.create(
-            model=model,
-            messages=prompt,
-            max_tokens=RESPONSE_MAX_TOKENS,
-            temperature=0.3,
-        )
+        async with openai_slot("chat"):
+            stream = await client.chat.completions.create(
+                model=model,
+                messages=prompt,
+                max_tokens=RESPONSE_MAX_TOKENS,
+                temperature=0.3,
+                stream=True,
+            )
+
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    await streamer.feed(delta)
 
-        answer = (completion.choices[0].message.content or "").strip()
+        generated = streamer.text[len(prefix):].strip()
+        answer = prefix + generated
+
+        if query_vec is not None and generated:
+            ANSWER_CACHE.store(query_vec, *cache_key[1:], generated)
+
+        await streamer.finish()
 
     except Exception as e:
         logging.exception("OPENAI CHAT ERROR")
-        answer = f"⚠️ Ошибка при обращении к языковой модели: {e}"
-
-    if RAG_WARNING_PENDING:
-        answer = f"{RAG_WARNING_TEXT}\n\n{answer}"
-        RAG_WARNING_PENDING = False
+        answer = prefix + f"⚠️ Ошибка при обращении к языковой модели: {e}"
+        await streamer.finish(answer)
 
-    prompt.append({"role": "assistant", "content": answer})
-    save_session(filename, session, prompt)
+    _save_answer(chat_key, prompt, answer)
 
     return answer
 
@@ -0,0 +1,55 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Dict
+
+from openai import AsyncOpenAI
+
+
+# ===============================================================
+# SETTINGS
+# ===============================================================
+
+# Таймаут одного запроса к OpenAI (секунды)
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+
+# Повторы на 429 / 5xx / сетевые ошибки.
+# SDK сам делает экспоненциальный backoff с учётом Retry-After.
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+
+# Сколько одновременных запросов разрешено на каждый тип эндпоинта
+CONCURRENCY_LIMITS: Dict[str, int] = {
+    "chat": int(os.getenv("OPENAI_CHAT_CONCURRENCY", "8")),
+    "search": int(os.getenv("OPENAI_SEARCH_CONCURRENCY", "4")),
+    "vision": int(os.getenv("OPENAI_VISION_CONCURRENCY", "4")),
+    "image": int(os.getenv("OPENAI_IMAGE_CONCURRENCY", "2")),
+}
+
+
+client = AsyncOpenAI(
+    timeout=OPENAI_TIMEOUT,
+    max_retries=OPENAI_MAX_RETRIES,
+)
+
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+
+def _get_semaphore(endpoint: str) -> asyncio.Semaphore:
+    sem = _semaphores.get(endpoint)
+    if sem is None:
+        sem = asyncio.Semaphore(CONCURRENCY_LIMITS.get(endpoint, 4))
+        _semaphores[endpoint] = sem
+    return sem
+
+
+@asynccontextmanager
+async def openai_slot(endpoint: str):
+    """
+    Ограничивает число параллельных запросов к одному эндпоинту.
+
+    Пример:
+        async with openai_slot("chat"):
+            await client.chat.completions.create(...)
+    """
+    async with _get_semaphore(endpoint):
+        yield
@@ -0,0 +1,94 @@
+from typing import List, Optional, Tuple
+
+from utils.store import SUMMARY_PREFIX
+from utils.utils import sys_mess, token_counter
+
+Prompt = List[dict]
+
+
+def is_summary(message: dict) -> bool:
+    return (
+        message.get("role") == "system"
+        and str(message.get("content", "")).startswith(SUMMARY_PREFIX)
+    )
+
+
+def _truncate_to_tokens(message: dict, max_tokens: int) -> Optional[dict]:
+    """Укорачивает текст сообщения, пока оно не влезет в max_tokens."""
+    content = str(message.get("content", ""))
+
+    for _ in range(5):
+        candidate = {**message, "content": content}
+        tokens = token_counter.count(candidate)
+        if tokens <= max_tokens:
+            return candidate
+
+        keep = int(len(content) * max_tokens / tokens * 0.95)
+        if keep <= 0:
+            return None
+        content = content[:keep].rstrip() + "…"
+
+    return None
+
+
+def build_prompt(
+    history: Prompt,
+    required: Prompt,
+    rag_msg: Optional[dict] = None,
+    budget: int = 4000,
+    history_budget: Optional[int] = None,
+) -> Tuple[Prompt, int]:
+    """
+    Собирает промпт в пределах бюджета токенов.
+
+    Приоритеты (от обязательного к лишнему):
+      1. системный промпт и required (текущий вопрос) — всегда;
+      2. RAG-контекст — при нехватке места укорачивается;
+      3. резюме прошлого диалога;
+      4. последние реплики — от новых к старым, пока хватает места
+         (но не больше history_budget токенов).
+
+    Возвращает (prompt, dropped) — сколько реплик диалога не поместилось.
+    """
+
+    system_msg = {"role": "system", "content": sys_mess}
+
+    summaries = [m for m in history if is_summary(m)]
+    dialog = [m for m in history if m.get("role") != "system"]
+
+    left = budget - token_counter.count_messages([system_msg] + required)
+
+    # --- RAG-контекст ---
+    rag_part: List[dict] = []
+    if rag_msg is not None and left > 0:
+        fitted = _truncate_to_tokens(rag_msg, left)
+        if fitted is not None:
+            rag_part = [fitted]
+            left -= token_counter.count(fitted)
+
+    # --- резюме ---
+    summary_part: List[dict] = []
+    for m in summaries:
+        tokens = token_counter.count(m)
+        if tokens > left:
+            break
+        summary_part.append(m)
+        left -= tokens
+
+    # --- последние реплики ---
+    if history_budget is not None:
+        left = min(left, history_budget)
+
+    recent: List[dict] = []
+    for m in reversed(dialog):
+        tokens = token_counter.count(m)
+        if tokens > left:
+            break
+        recent.append(m)
+        left -= tokens
+    recent.reverse()
+
+    dropped = len(dialog) - len(recent)
+
+    prompt = [system_msg] + rag_part + summary_part + recent + required
+    return prompt, dropped
@@ -15,12 +15,17 @@ from functions.additional_func import (
 )
 
 from functions.chat_func import (
+    STREAM_REPLIES,
+    direct_reply,
     process_and_send_mess,
     start_and_check,
     get_openai_response,
+    stream_openai_response,
 )
 
-from utils.utils import get_date_time
+from rag.scope import display_name, resolve_department
+from rag.search import areload_index, active_snapshot, batch_stats, cache_stats, departments
+from utils.utils import get_date_time, read_existing_conversation, save_session_state
 
 
 # =====================================================
@@ -47,6 +52,11 @@ SEARCH_TRIGGERS = [
     "поиск",
 ]
 
+# Telegram user id администраторов (через запятую) — для служебных команд
+ADMIN_IDS = {
+    int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x
+}
+
 IMAGE_QUESTION_PHRASES = [
     "что на фото",
     "что на картинке",
@@ -62,11 +72,13 @@ HELP_TEXT = """
 Команды:
  /search <запрос> — поиск в интернете
  /img <описание> — генерация изображения
+ /scope <отдел> — искать в базе знаний только по отделу (/scope — сброс)
  /today — текущая дата
  /clear — очистка истории
  /help — справка
 
 ℹ️ Напишите «помощь» — покажу возможности бота.
+🏷 Хэштег отдела в вопросе (#касса, #тсд) ищет только по его документам.
 """
 
 
@@ -124,6 +136,81 @@ async def clear_handler(event):
     raise events.StopPropagation
 
 
+@events.register(events.NewMessage(pattern=r"/reload_rag"))
+async def reload_rag_handler(event):
+    if event.sender_id not in ADMIN_IDS:
+        raise events.StopPropagation
+
+    await event.respond("🔄 Перезагружаю базу знаний...")
+
+    if await areload_index():
+        snap = active_snapshot()
+        await event.respond(f"✅ База знаний обновлена. Фрагментов: {len(snap)}")
+    else:
+        await event.respond("❌ Не удалось загрузить новый индекс, работает прежний.")
+
+    raise events.StopPropagation
+
+
+@events.register(events.NewMessage(pattern=r"/rag_stats"))
+async def rag_stats_handler(event):
+    if event.sender_id not in ADMIN_IDS:
+        raise events.StopPropagation
+
+    batches = batch_stats()
+    sizes = ", ".join(f"{k}×{v}" for k, v in batches["sizes"].items()) or "—"
+    lines = [
+        "📊 RAG",
+        f"Батчи эмбеддинга: {batches['batches']}, запросов: {batches['queries']}",
+        f"Средний размер: {batches['avg_size']}, максимум: {batches['max_size']}",
+        f"Размеры (размер×раз): {sizes}",
+    ]
+
+    names = {"embeddings": "Кэш эмбеддингов", "results": "Кэш результатов"}
+    for key, stats in cache_stats().items():
+        lines.append(
+            f"{names.get(key, key)}: {stats['hits']} попаданий, "
+            f"{stats['misses']} промахов ({stats['hit_rate']:.0%}), "
+            f"записей {stats['size']}/{stats['maxsize']}"
+        )
+
+    await event.respond("\n".join(lines))
+    raise events.StopPropagation
+
+
+@events.register(events.NewMessage(pattern=r"/scope"))
+@events.register(events.NewMessage(pattern=r"/отдел"))
+async def scope_handler(event):
+    hint = re.sub(r"/(scope|отдел)", "", event.raw_text, flags=re.IGNORECASE).strip()
+
+    session, chat_key, _ = read_existing_conversation(str(event.chat_id))
+    available = departments()
+
+    if not hint or hint.lower() in ("все", "всё", "off", "-"):
+        session.pop("rag_scope", None)
+        save_session_state(chat_key, session)
+        names = ", ".join(display_name(d) for d in available)
+        reply = "🔎 Ищу по всей базе знаний."
+        if names:
+            reply += f"\nОтделы: {names}"
+        await process_and_send_mess(event, reply)
+        raise events.StopPropagation
+
+    dep = resolve_department(hint, available)
+    if dep is None:
+        names = ", ".join(display_name(d) for d in available) or "база ещё не загружена"
+        await process_and_send_mess(event, f"Не нашёл отдел «{hint}». Есть: {names}")
+        raise events.StopPropagation
+
+    session["rag_scope"] = dep
+    save_session_state(chat_key, session)
+    await process_and_send_mess(
+        event,
+        f"🔎 Ищу только в документах отдела «{display_name(dep)}». Сбросить: /scope",
+    )
+    raise events.StopPropagation
+
+
 # =====================================================
 # IMAGE GENERATION (/img)
 # =====================================================
@@ -290,15 +377,23 @@ async def universal_handler(event):
         except Exception:
             logging.debug("Typing indicator failed")
 
-        session, filename, history = await start_and_check(
+        session, chat_key, history, answer_key = await start_and_check(
             event,
             text,
             event.chat_id,
         )
 
-        answer = await get_openai_response(session, history, filename)
+        # уточнение «искать в интернете?» или результат веб-поиска
+        reply = direct_reply(history)
+        if reply is not None:
+            await process_and_send_mess(event, reply)
+            raise events.StopPropagation
 
-        await process_and_send_mess(event, answer)
+        if STREAM_REPLIES:
+            await stream_openai_response(event, session, history, chat_key, answer_key)
+        else:
+            answer = await get_openai_response(session, history, chat_key, answer_key)
+            await process_and_send_mess(event, answer)
 
         raise events.StopPropagation
 
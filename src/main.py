@@ -1,7 +1,14 @@
 import asyncio
 import logging
+import signal
+import sys
 
-from bot.bot import client, start_bot
+# Первым: от импорта этого модуля отсчитывается время старта
+from utils.startup import STARTUP
+
+with STARTUP.stage("imports"):
+    from bot.bot import client, start_bot
+    from utils.utils import flush_sessions
 
 logging.basicConfig(
     level=logging.INFO,
@@ -14,5 +21,13 @@ if __name__ == "__main__":
     # Асинхронный старт клиента
     asyncio.run(start_bot())
 
-    # Блокирующий цикл Telethon
-    client.run_until_disconnected()
+    # SIGTERM (остановка/редеплой на Render) превращаем в обычный выход,
+    # чтобы успеть сбросить диалоги из памяти в базу
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    try:
+        # Блокирующий цикл Telethon
+        client.run_until_disconnected()
+    finally:
+        flushed = flush_sessions()
+        logging.info(f"💾 Сохранено диалогов при остановке: {flushed}")
@@ -0,0 +1,143 @@
+import logging
+from typing import Any, Dict, Tuple
+
+import faiss
+import numpy as np
+
+
+# Поддерживаемые типы индекса (выбираются при сборке в build_faiss.py)
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+
+# Минимум обучающих векторов на один кластер IVF (рекомендация FAISS)
+MIN_POINTS_PER_CENTROID = 39
+
+
+def index_spec(
+    index_type: str,
+    n_vectors: int,
+    nlist: int = 256,
+    hnsw_m: int = 32,
+    pq_m: int = 16,
+    pq_bits: int = 8,
+) -> Dict[str, Any]:
+    """Параметры индекса; nlist ужимается под размер корпуса."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+
+    spec: Dict[str, Any] = {"type": index_type}
+
+    if index_type in ("ivf", "ivfpq"):
+        max_nlist = max(1, n_vectors // MIN_POINTS_PER_CENTROID)
+        spec["nlist"] = max(1, min(nlist, max_nlist))
+    if index_type == "hnsw":
+        spec["hnsw_m"] = hnsw_m
+    if index_type == "ivfpq":
+        spec["pq_m"] = pq_m
+        spec["pq_bits"] = pq_bits
+
+    return spec
+
+
+def factory_string(spec: Dict[str, Any]) -> str:
+    """
+    Строка для faiss.index_factory.
+
+    IVF хранит id векторов сам, поэтому id-обёртка нужна только
+    плоскому индексу и HNSW.
+    """
+    t = spec["type"]
+    if t == "flat":
+        return "IDMap2,Flat"
+    if t == "hnsw":
+        return f"IDMap2,HNSW{spec['hnsw_m']},Flat"
+    if t == "ivf":
+        return f"IVF{spec['nlist']},Flat"
+    if t == "ivfpq":
+        return f"IVF{spec['nlist']},PQ{spec['pq_m']}x{spec['pq_bits']}"
+    raise ValueError(f"Unknown index type: {t}")
+
+
+def make_index(spec: Dict[str, Any], dim: int, train_vectors: np.ndarray):
+    """Создаёт (и при необходимости обучает) пустой индекс по spec."""
+    index = faiss.index_factory(dim, factory_string(spec))
+
+    if not index.is_trained:
+        logging.info(f"Training {spec['type']} index on {len(train_vectors)} vectors")
+        index.train(train_vectors)
+
+    return index
+
+
+def supports_remove(spec: Dict[str, Any]) -> bool:
+    """HNSW не умеет удалять векторы — его пересобираем целиком."""
+    return spec.get("type") != "hnsw"
+
+
+def _unwrap(index):
+    # IndexIDMap / IndexIDMap2 -> вложенный индекс
+    if hasattr(index, "id_map"):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def _find_ivf(inner):
+    try:
+        return faiss.extract_index_ivf(inner)
+    except Exception:
+        return None
+
+
+def apply_search_params(index, nprobe: int, ef_search: int) -> Tuple[str, Dict[str, int]]:
+    """
+    Выставляет параметры поиска ANN-индекса.
+
+    nprobe — сколько кластеров IVF просматривать;
+    ef_search — ширина поиска по графу HNSW.
+    Для плоского индекса ничего не делает.
+    """
+    applied: Dict[str, int] = {}
+    inner = _unwrap(index)
+    ivf = _find_ivf(inner)
+
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+        applied["nprobe"] = ivf.nprobe
+        return "ivf", applied
+
+    if hasattr(inner, "hnsw"):
+        inner.hnsw.efSearch = ef_search
+        applied["efSearch"] = ef_search
+        return "hnsw", applied
+
+    return "flat", applied
+
+
+def id_selector(ids: np.ndarray):
+    """IDSelector по набору id; только читается при поиске, его можно делить."""
+    return faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype="int64"))
+
+
+def filtered_search_params(index, sel, widen: int = 1):
+    """
+    SearchParameters, ограничивающие поиск векторами из селектора.
+
+    Селектор проверяется внутри самого поиска, поэтому top-k набирается
+    только из области, а не отфильтровывается после. Для IVF и HNSW
+    параметры передаются явно (иначе FAISS возьмёт значения по умолчанию,
+    а не выставленные apply_search_params); widen во столько раз расширяет
+    nprobe / efSearch — при узкой области в просмотренных кластерах
+    и соседях её векторов мало.
+
+    Объект создаётся на каждый поиск: IndexIDMap на время поиска
+    подменяет в нём селектор, делить его между потоками нельзя.
+    """
+    inner = _unwrap(index)
+    ivf = _find_ivf(inner)
+
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=sel, nprobe=min(ivf.nprobe * widen, ivf.nlist))
+
+    if hasattr(inner, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=inner.hnsw.efSearch * widen)
+
+    return faiss.SearchParameters(sel=sel)
@@ -0,0 +1,227 @@
+"""
+Сравнение бэкендов эмбеддингов (rag/embeddings.py) с эталоном torch.
+
+Для каждого бэкенда — в отдельном процессе, чтобы честно мерить память:
+  • load_s     — время загрузки модели;
+  • rss_mb     — прирост RSS после загрузки и прогона;
+  • query_ms   — задержка одного запроса (mean / p95);
+  • batch_tps  — пропускная способность, текстов в секунду при батче --batch;
+  • cos        — средний косинус векторов запросов с эталонными;
+  • agree@k    — совпадение top-k, если и корпус, и запросы посчитаны бэкендом;
+  • cross@k    — совпадение top-k при запросах бэкенда к эталонному корпусу
+                 (индекс собран torch, бот кодирует запросы другим бэкендом).
+
+Тексты корпуса — из chunks.sqlite3 (или docs.jsonl), запросы — из --queries
+или первые слова случайных чанков.
+
+Пример:
+  python src/rag/bench_embed.py --backends torch onnx onnx-int8 --n-docs 500
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import random
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+if __package__ in (None, ""):
+    # запуск скриптом: python src/rag/bench_embed.py
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from rag.embeddings import EMBED_BACKENDS
+
+BASE_DIR = Path(__file__).resolve().parent
+CHUNKS_DB_FILE = BASE_DIR / "chunks.sqlite3"
+DOCS_FILE = BASE_DIR / "docs.jsonl"
+
+BASELINE = "torch"
+
+
+# =====================================================
+# DATA
+# =====================================================
+
+def load_texts(n: int, seed: int) -> List[str]:
+    if CHUNKS_DB_FILE.exists():
+        conn = sqlite3.connect(f"file:{CHUNKS_DB_FILE}?mode=ro", uri=True)
+        texts = [row[0] for row in conn.execute("SELECT text FROM chunks")]
+        conn.close()
+    elif DOCS_FILE.exists():
+        with open(DOCS_FILE, encoding="utf8") as f:
+            texts = [json.loads(line)["text"] for line in f if line.strip()]
+    else:
+        raise SystemExit("No chunks found: run parse_docs.py / build_faiss.py first")
+
+    texts = [t for t in texts if t.strip()]
+    random.Random(seed).shuffle(texts)
+    return texts[:n]
+
+
+def load_queries(path, texts: List[str], n: int, seed: int) -> List[str]:
+    if path:
+        with open(path, encoding="utf8") as f:
+            return [line.strip() for line in f if line.strip()]
+
+    rng = random.Random(seed + 1)
+    picked = rng.sample(texts, min(n, len(texts)))
+    return [" ".join(t.split()[:12]) for t in picked]
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+# =====================================================
+# WORKER
+# =====================================================
+
+def run_backend(backend: str, texts: List[str], queries: List[str], batch: int, conn) -> None:
+    """Выполняется в дочернем процессе; результат уходит в pipe."""
+    try:
+        from rag.embeddings import load_embedder
+
+        rss_before = rss_mb()
+        t0 = time.perf_counter()
+        model = load_embedder(backend, fallback=False)
+        load_s = time.perf_counter() - t0
+
+        # прогрев: первые вызовы дороже из-за ленивой инициализации
+        model.encode(queries[:2], batch_size=2)
+
+        latencies = []
+        query_vecs = []
+        for q in queries:
+            t0 = time.perf_counter()
+            query_vecs.append(model.encode([q], batch_size=1)[0])
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        doc_vecs = model.encode(texts, batch_size=batch)
+        batch_s = time.perf_counter() - t0
+
+        conn.send({
+            "backend": backend,
+            "name": model.name,
+            "load_s": load_s,
+            "rss_mb": rss_mb() - rss_before,
+            "query_ms_mean": float(np.mean(latencies)),
+            "query_ms_p95": float(np.percentile(latencies, 95)),
+            "batch_tps": len(texts) / batch_s if batch_s > 0 else 0.0,
+            "queries": np.asarray(query_vecs, dtype="float32"),
+            "docs": np.asarray(doc_vecs, dtype="float32"),
+        })
+    except Exception as e:
+        conn.send({"backend": backend, "error": repr(e)})
+    finally:
+        conn.close()
+
+
+def measure_in_subprocess(backend: str, texts, queries, batch: int) -> Dict:
+    ctx = mp.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=run_backend, args=(backend, texts, queries, batch, child))
+    proc.start()
+    child.close()
+    result = parent.recv()
+    proc.join()
+    return result
+
+
+# =====================================================
+# AGREEMENT
+# =====================================================
+
+def top_k(queries: np.ndarray, docs: np.ndarray, k: int) -> np.ndarray:
+    # точный L2-поиск, как IndexFlatL2
+    d = (
+        (queries ** 2).sum(axis=1)[:, None]
+        - 2 * queries @ docs.T
+        + (docs ** 2).sum(axis=1)[None, :]
+    )
+    return np.argsort(d, axis=1)[:, :k]
+
+
+def overlap(a: np.ndarray, b: np.ndarray) -> float:
+    k = a.shape[1]
+    return float(np.mean([len(set(x) & set(y)) / k for x, y in zip(a.tolist(), b.tolist())]))
+
+
+def mean_cosine(a: np.ndarray, b: np.ndarray) -> float:
+    num = (a * b).sum(axis=1)
+    den = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    return float(np.mean(num / np.clip(den, 1e-12, None)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк бэкендов эмбеддингов")
+    parser.add_argument("--backends", nargs="+", choices=EMBED_BACKENDS, default=list(EMBED_BACKENDS))
+    parser.add_argument("--n-docs", type=int, default=500)
+    parser.add_argument("--n-queries", type=int, default=100)
+    parser.add_argument("--queries", help="файл с запросами, по одному на строку")
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="сохранить отчёт в файл")
+    args = parser.parse_args()
+
+    texts = load_texts(args.n_docs, args.seed)
+    queries = load_queries(args.queries, texts, args.n_queries, args.seed)
+    k = min(args.k, len(texts))
+    print(f"📄 Docs: {len(texts)}, queries: {len(queries)}, k={k}")
+
+    backends = [BASELINE] + [b for b in args.backends if b != BASELINE]
+    results = {}
+    for backend in backends:
+        print(f"⏳ {backend}...")
+        results[backend] = measure_in_subprocess(backend, texts, queries, args.batch)
+
+    base = results[BASELINE]
+    if "error" in base:
+        raise SystemExit(f"Baseline {BASELINE} failed: {base['error']}")
+    base_top = top_k(base["queries"], base["docs"], k)
+
+    rows = []
+    print()
+    for backend in backends:
+        r = results[backend]
+        if "error" in r:
+            print(f"{backend:<11} failed: {r['error']}")
+            continue
+
+        row = {
+            key: r[key]
+            for key in (
+                "backend", "name", "load_s", "rss_mb",
+                "query_ms_mean", "query_ms_p95", "batch_tps",
+            )
+        }
+        row["cos"] = mean_cosine(r["queries"], base["queries"])
+        row[f"agree@{k}"] = overlap(top_k(r["queries"], r["docs"], k), base_top)
+        row[f"cross@{k}"] = overlap(top_k(r["queries"], base["docs"], k), base_top)
+        rows.append(row)
+
+        print(
+            f"{backend:<11} load={row['load_s']:.1f}s  rss=+{row['rss_mb']:.0f}MB  "
+            f"query={row['query_ms_mean']:.1f}ms (p95 {row['query_ms_p95']:.1f})  "
+            f"batch={row['batch_tps']:.0f} txt/s  cos={row['cos']:.4f}  "
+            f"agree@{k}={row[f'agree@{k}']:.3f}  cross@{k}={row[f'cross@{k}']:.3f}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"💾 Report: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
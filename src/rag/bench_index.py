@@ -0,0 +1,178 @@
+"""
+Сравнение типов FAISS-индекса: полнота (recall@k) против задержки.
+
+Векторы берутся из кэша эмбеддингов build_faiss.py (embeddings_cache.npz
++ faiss_state.json), поэтому модель для корпуса не нужна — сначала
+соберите индекс хотя бы один раз. Эталон — точный поиск IndexFlatL2.
+
+Запросы:
+  --queries file.txt — по запросу на строку (кодируются моделью);
+  иначе — случайные векторы корпуса со слабым шумом.
+
+Пример:
+  python src/rag/bench_index.py --k 5 --queries questions.txt
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import faiss
+import numpy as np
+
+if __package__ in (None, ""):
+    # запуск скриптом: python src/rag/bench_index.py
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from rag.ann import apply_search_params, index_spec, make_index
+from rag.build_faiss import EMBEDDINGS_CACHE_FILE, STATE_FILE, load_state
+
+NPROBE_SWEEP = (1, 4, 8, 16, 32, 64)
+EF_SEARCH_SWEEP = (16, 32, 64, 128, 256)
+
+
+# =====================================================
+# DATA
+# =====================================================
+
+def load_corpus() -> np.ndarray:
+    """Векторы всех чанков текущего индекса из кэша эмбеддингов."""
+    if not EMBEDDINGS_CACHE_FILE.exists() or not STATE_FILE.exists():
+        raise SystemExit("Run build_faiss.py first: embeddings cache not found")
+
+    data = np.load(EMBEDDINGS_CACHE_FILE)
+    cache = dict(zip(data["hashes"].tolist(), data["vectors"]))
+
+    _, state = load_state()
+    vectors = [cache[h] for h in state.values() if h in cache]
+    if not vectors:
+        raise SystemExit("Embeddings cache is empty")
+
+    return np.stack(vectors).astype("float32")
+
+
+def load_queries(path, corpus: np.ndarray, n: int, seed: int) -> np.ndarray:
+    if path:
+        from rag.embeddings import load_embedder
+
+        with open(path, encoding="utf8") as f:
+            lines = [line.strip() for line in f if line.strip()]
+        return load_embedder().encode(lines)
+
+    rng = np.random.default_rng(seed)
+    picked = corpus[rng.choice(len(corpus), size=min(n, len(corpus)), replace=False)]
+    noise = rng.normal(0, 0.01, size=picked.shape).astype("float32")
+    return picked + noise
+
+
+# =====================================================
+# MEASURE
+# =====================================================
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found.tolist(), truth.tolist()))
+    return hits / (len(truth) * k)
+
+
+def measure(index, queries: np.ndarray, k: int, truth: np.ndarray) -> Dict[str, float]:
+    # по одному запросу — как в боте
+    latencies: List[float] = []
+    found = np.empty((len(queries), k), dtype="int64")
+
+    for i, q in enumerate(queries):
+        t0 = time.perf_counter()
+        _, ids = index.search(q.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        found[i] = ids[0]
+
+    return {
+        "recall": recall_at_k(found, truth),
+        "mean_ms": float(np.mean(latencies)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+def build(spec: Dict, corpus: np.ndarray):
+    t0 = time.perf_counter()
+    index = make_index(spec, corpus.shape[1], corpus)
+    index.add_with_ids(corpus, np.arange(len(corpus), dtype="int64"))
+    return index, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк типов FAISS-индекса")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", help="файл с запросами, по одному на строку")
+    parser.add_argument("--n-queries", type=int, default=200)
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--pq-m", type=int, default=16)
+    parser.add_argument("--pq-bits", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="сохранить отчёт в файл")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(1)
+
+    corpus = load_corpus()
+    queries = load_queries(args.queries, corpus, args.n_queries, args.seed)
+    k = min(args.k, len(corpus))
+    print(f"📄 Corpus: {len(corpus)} x {corpus.shape[1]}, queries: {len(queries)}, k={k}")
+
+    rows = []
+
+    def report(spec: Dict, params: Dict, build_s: float, m: Dict[str, float]) -> None:
+        row = {**spec, **params, "build_s": round(build_s, 3), **m}
+        rows.append(row)
+        label = ", ".join(f"{k_}={v}" for k_, v in params.items()) or "-"
+        print(
+            f"{spec['type']:<6} {label:<14} "
+            f"recall@{k}={m['recall']:.3f}  "
+            f"mean={m['mean_ms']:.3f}ms  p95={m['p95_ms']:.3f}ms  "
+            f"build={build_s:.1f}s"
+        )
+
+    # --- эталон ---
+    flat_spec = index_spec("flat", len(corpus))
+    flat, build_s = build(flat_spec, corpus)
+    _, truth = flat.search(queries, k)
+    report(flat_spec, {}, build_s, measure(flat, queries, k, truth))
+
+    # --- ANN ---
+    for index_type in ("ivf", "ivfpq", "hnsw"):
+        spec = index_spec(
+            index_type,
+            len(corpus),
+            nlist=args.nlist,
+            hnsw_m=args.hnsw_m,
+            pq_m=args.pq_m,
+            pq_bits=args.pq_bits,
+        )
+        try:
+            index, build_s = build(spec, corpus)
+        except Exception as e:
+            # например, PQ: размерность не делится на pq_m или мало векторов
+            print(f"{index_type:<6} skipped: {e}")
+            continue
+
+        if index_type == "hnsw":
+            sweep = [(0, ef) for ef in EF_SEARCH_SWEEP]
+        else:
+            sweep = [(p, 0) for p in NPROBE_SWEEP if p <= spec["nlist"]]
+
+        for nprobe, ef_search in sweep:
+            _, params = apply_search_params(index, nprobe, ef_search)
+            report(spec, params, build_s, measure(index, queries, k, truth))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"💾 Report: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
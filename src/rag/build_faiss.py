@@ -1,66 +1,361 @@
+"""
+Сборка FAISS-индекса по чанкам базы знаний.
+
+Индекс инкрементальный: у каждого чанка стабильный id
+(source + page + section + порядковый номер на странице),
+поэтому при повторном запуске из индекса удаляются только пропавшие
+и изменившиеся чанки, а добавляются только новые. Эмбеддинги
+кэшируются по хэшу текста чанка и повторно не считаются. Вариант модели
+(torch / onnx / int8) задаёт RAG_EMBED_BACKEND, см. embeddings.py; при его
+смене кэш и индекс пересобираются.
+
+Дубли (одинаковые и почти одинаковые тексты из разных папок и
+форматов) схлопываются в один вектор, остальные вхождения сохраняются
+как источники чанка, см. dedup.py; отключить — --no-dedup.
+
+Вход — чанки из parse_docs.py (docs.jsonl) или старый raw_docs.json.
+Выход — faiss.index и chunks.sqlite3 (текст и метаданные чанков по id,
+бот читает из него только найденные чанки, плюс FTS5-индекс для BM25).
+
+Тип индекса выбирается флагом --index-type:
+  flat  — точный поиск (по умолчанию);
+  ivf   — IVF-Flat, параметр --nlist;
+  hnsw  — граф HNSW, параметр --hnsw-m;
+  ivfpq — IVF с PQ-сжатием, параметры --nlist, --pq-m, --pq-bits.
+Сравнить полноту и скорость вариантов: bench_index.py.
+"""
+
+import argparse
+import hashlib
 import json
+import os
+import sys
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
 import faiss
-from sentence_transformers import SentenceTransformer
+import numpy as np
 from tqdm import tqdm
 
-RAW_FILE = "src/rag/raw_docs.json"
-CHUNKS_FILE = "src/rag/docs.json"
-INDEX_FILE = "src/rag/faiss.index"
+if __package__ in (None, ""):
+    # запуск скриптом: python src/rag/build_faiss.py
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
-CHUNK_SIZE = 900
+from rag.ann import INDEX_TYPES, index_spec, make_index, supports_remove
+from rag.chunk_store import write_chunk_store
+from rag.chunking import chunk_text
+from rag.dedup import RAG_DEDUP, RAG_DEDUP_DISTANCE, collapse_duplicates
+from rag.embeddings import embedder_id, load_embedder
 
+BASE_DIR = Path(__file__).resolve().parent
 
-def chunk_text(text):
-    words = text.split()
-    for i in range(0, len(words), CHUNK_SIZE):
-        yield " ".join(words[i:i + CHUNK_SIZE])
+RAW_FILE = BASE_DIR / "raw_docs.json"
+CHUNKS_FILE = BASE_DIR / "docs.jsonl"
+# Выход parse_docs.py до перехода на JSON Lines
+LEGACY_CHUNKS_FILE = BASE_DIR / "docs.json"
+# Чанки по id для бота (rag/chunk_store.py)
+CHUNKS_DB_FILE = BASE_DIR / "chunks.sqlite3"
+INDEX_FILE = BASE_DIR / "faiss.index"
+# id чанка -> хэш текста, из которого посчитан вектор в индексе
+STATE_FILE = BASE_DIR / "faiss_state.json"
+# Кэш эмбеддингов по хэшу текста чанка
+EMBEDDINGS_CACHE_FILE = BASE_DIR / "embeddings_cache.npz"
 
+# Кэш и индекс, собранные до выбора бэкенда эмбеддингов
+LEGACY_EMBEDDER = "all-MiniLM-L6-v2:torch"
 
-def main():
+# =====================================================
+# IDS
+# =====================================================
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def stable_chunk_id(source: str, page, section, offset: int) -> int:
+    """Стабильный 63-битный id чанка (FAISS хранит id как int64)."""
+    key = f"{source}|{page or ''}|{section or ''}|{offset}"
+    digest = hashlib.sha1(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") & 0x7FFF_FFFF_FFFF_FFFF
+
+
+def assign_ids(chunks: List[Dict]) -> None:
+    """Проставляет offset, id и hash каждому чанку (на месте)."""
+    offsets: Dict[tuple, int] = {}
+    for ch in chunks:
+        key = (ch.get("source"), ch.get("page"), ch.get("section"))
+        offset = offsets.get(key, 0)
+        offsets[key] = offset + 1
+
+        ch["offset"] = offset
+        ch["id"] = stable_chunk_id(*key, offset)
+        ch["hash"] = text_hash(ch["text"])
+
+
+# =====================================================
+# INPUT
+# =====================================================
+
+def iter_jsonl(path: Path) -> Iterator[Dict]:
+    with open(path, encoding="utf8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
 
-    print("📥 Load RAW documents...")
-    with open(RAW_FILE, encoding="utf8") as f:
-        docs = json.load(f)
 
-    print(f"📄 Documents: {len(docs)}")
+def iter_docs() -> Iterator[Dict]:
+    if RAW_FILE.exists():
+        print("📥 Load RAW documents...")
+        with open(RAW_FILE, encoding="utf8") as f:
+            yield from json.load(f)
+    elif CHUNKS_FILE.exists():
+        print("📥 Load parsed chunks...")
+        yield from iter_jsonl(CHUNKS_FILE)
+    else:
+        print("📥 Load parsed chunks (legacy docs.json)...")
+        with open(LEGACY_CHUNKS_FILE, encoding="utf8") as f:
+            yield from json.load(f)
 
+
+def load_chunks() -> List[Dict]:
     chunks = []
+    n_docs = 0
 
-    print("🔪 Chunking texts...")
-    for d in tqdm(docs):
-        for c in chunk_text(d["text"]):
-            chunks.append({
-                "source": d["source"],
-                "text": c,
-            })
+    # Режутся только целые документы raw_docs.json; чанки parse_docs.py
+    # уже нарезаны по бюджету, и второй раз их не токенизируем
+    split = RAW_FILE.exists()
 
-    print(f"✂ Total chunks: {len(chunks)}")
+    for d in tqdm(iter_docs(), desc="🔪 Chunking"):
+        n_docs += 1
+        meta = {
+            k: v for k, v in d.items()
+            if k not in ("text", "id", "offset", "hash")
+        }
+        text = (d.get("text") or "").strip()
+        for c in (chunk_text(text) if split else [text] if text else []):
+            chunks.append({**meta, "text": c})
+
+    print(f"📄 Documents: {n_docs}")
+    return chunks
+
+
+# =====================================================
+# CACHE / STATE
+# =====================================================
+
+def load_embeddings_cache(embedder: str) -> Dict[str, np.ndarray]:
+    """Кэш годится, только если посчитан тем же вариантом модели."""
+    if not EMBEDDINGS_CACHE_FILE.exists():
+        return {}
+    data = np.load(EMBEDDINGS_CACHE_FILE)
+
+    cached_by = str(data["embedder"]) if "embedder" in data.files else LEGACY_EMBEDDER
+    if cached_by != embedder:
+        print(f"♻ Embeddings cache is from {cached_by}, re-encoding with {embedder}")
+        return {}
+
+    return dict(zip(data["hashes"].tolist(), data["vectors"]))
+
+
+def save_embeddings_cache(cache: Dict[str, np.ndarray], keep: set, embedder: str) -> None:
+    hashes = sorted(h for h in cache if h in keep)
+    if not hashes:
+        return
+    vectors = np.stack([cache[h] for h in hashes]).astype("float32")
+    tmp = EMBEDDINGS_CACHE_FILE.with_name("embeddings_cache.tmp.npz")
+    np.savez(tmp, hashes=np.array(hashes), vectors=vectors, embedder=np.array(embedder))
+    os.replace(tmp, EMBEDDINGS_CACHE_FILE)
+
+
+def load_state() -> Tuple[Dict, Dict[int, str]]:
+    """(параметры индекса, id чанка -> хэш текста)."""
+    if not STATE_FILE.exists():
+        return {}, {}
+    with open(STATE_FILE, encoding="utf8") as f:
+        data = json.load(f)
+
+    if "ids" not in data:
+        # первая версия файла: только id -> хэш для плоского индекса
+        return {"type": "flat"}, {int(k): v for k, v in data.items()}
+
+    return data.get("index", {}), {int(k): v for k, v in data["ids"].items()}
+
+
+def load_existing_index(spec: Dict):
+    """
+    Старый индекс, если он с id, того же типа и к нему есть состояние.
 
-    model = SentenceTransformer("all-MiniLM-L6-v2")
+    Возвращает (index, state, spec). У дообучаемого индекса остаются
+    прежние параметры (nlist и т.п.) — поэтому возвращается старый spec.
+    """
+    if not INDEX_FILE.exists() or not STATE_FILE.exists():
+        return None, {}, spec
 
-    texts = [c["text"] for c in chunks]
+    old_spec, state = load_state()
+    if old_spec.get("type") != spec["type"]:
+        # поменяли тип индекса — только полная пересборка
+        return None, {}, spec
 
-    print("🧠 Generating embeddings...")
+    if old_spec.get("embedder", LEGACY_EMBEDDER) != spec["embedder"]:
+        # векторы другого варианта модели в одном индексе не смешиваем
+        return None, {}, spec
 
+    index = faiss.read_index(str(INDEX_FILE))
+    if spec["type"] == "flat" and not hasattr(index, "id_map"):
+        # старый IndexFlatL2 без id — только полная пересборка
+        return None, {}, spec
+
+    return index, state, {**spec, **old_spec}
+
+
+def write_json_atomic(path: Path, data, indent=None) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "w", encoding="utf8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+    os.replace(tmp, path)
+
+
+def write_index_atomic(index, path: Path) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    faiss.write_index(index, str(tmp))
+    os.replace(tmp, path)
+
+
+# =====================================================
+# BUILD
+# =====================================================
+
+def encode_missing(
+    model,
+    chunks: List[Dict],
+    cache: Dict[str, np.ndarray],
+) -> None:
+    missing = {}
+    for ch in chunks:
+        if ch["hash"] not in cache:
+            missing.setdefault(ch["hash"], ch["text"])
+
+    print(f"🧠 Generating embeddings: {len(missing)} new, {len(chunks) - len(missing)} cached")
+    if not missing:
+        return
+
+    hashes = list(missing)
     vectors = model.encode(
-        texts,
+        [missing[h] for h in hashes],
         batch_size=32,
         show_progress_bar=True,
     )
+    for h, v in zip(hashes, vectors):
+        cache[h] = np.asarray(v, dtype="float32")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка FAISS-индекса")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="пересобрать индекс с нуля (кэш эмбеддингов всё равно используется)",
+    )
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    parser.add_argument("--nlist", type=int, default=256, help="кластеров IVF")
+    parser.add_argument("--hnsw-m", type=int, default=32, help="связей на узел HNSW")
+    parser.add_argument("--pq-m", type=int, default=16, help="подвекторов PQ")
+    parser.add_argument("--pq-bits", type=int, default=8, help="бит на подвектор PQ")
+    parser.add_argument(
+        "--no-dedup",
+        dest="dedup",
+        action="store_false",
+        default=RAG_DEDUP,
+        help="не схлопывать дубли чанков",
+    )
+    parser.add_argument(
+        "--dedup-distance",
+        type=int,
+        default=RAG_DEDUP_DISTANCE,
+        help="порог почти-дублей в битах SimHash (-1 — только точные дубли)",
+    )
+    args = parser.parse_args()
 
-    print("📦 Building FAISS index...")
-    dim = vectors.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(vectors)
+    chunks = load_chunks()
+    assign_ids(chunks)
 
-    faiss.write_index(index, INDEX_FILE)
+    # одинаковый id у двух чанков означает дубль позиции — оставляем первый
+    by_id: Dict[int, Dict] = {}
+    for ch in chunks:
+        by_id.setdefault(ch["id"], ch)
+    chunks = list(by_id.values())
 
-    with open(CHUNKS_FILE, "w", encoding="utf8") as f:
-        json.dump(chunks, f, ensure_ascii=False, indent=2)
+    if args.dedup:
+        chunks, merged = collapse_duplicates(chunks, args.dedup_distance)
+        print(f"🧹 Duplicates collapsed: {merged}")
+
+    print(f"✂ Total chunks: {len(chunks)}")
+
+    if not chunks:
+        raise SystemExit("No chunks to index")
+
+    spec = index_spec(
+        args.index_type,
+        len(chunks),
+        nlist=args.nlist,
+        hnsw_m=args.hnsw_m,
+        pq_m=args.pq_m,
+        pq_bits=args.pq_bits,
+    )
+    spec["embedder"] = embedder_id()
+
+    cache = load_embeddings_cache(spec["embedder"])
+
+    if args.full:
+        index, state = None, {}
+    else:
+        index, state, spec = load_existing_index(spec)
+
+    new_state = {ch["id"]: ch["hash"] for ch in chunks}
+    to_remove = [i for i, h in state.items() if new_state.get(i) != h]
+
+    if index is not None and to_remove and not supports_remove(spec):
+        print(f"♻ {spec['type']} index cannot remove vectors — rebuilding")
+        index, state, to_remove = None, {}, []
+
+    to_add = [ch for ch in chunks if state.get(ch["id"]) != ch["hash"]]
+
+    if any(ch["hash"] not in cache for ch in to_add):
+        # без отката на torch: векторы должны совпадать с пометкой кэша
+        model = load_embedder(fallback=False)
+        encode_missing(model, to_add, cache)
+
+    if index is None:
+        print(f"📦 Building FAISS index from scratch: {spec}")
+        train = np.stack([cache[ch["hash"]] for ch in chunks]).astype("float32")
+        index = make_index(spec, train.shape[1], train)
+    else:
+        print(f"📦 Updating FAISS index: -{len(to_remove)} / +{len(to_add)}")
+        if to_remove:
+            index.remove_ids(np.array(to_remove, dtype="int64"))
+
+    if to_add:
+        vectors = np.stack([cache[ch["hash"]] for ch in to_add]).astype("float32")
+        ids = np.array([ch["id"] for ch in to_add], dtype="int64")
+        index.add_with_ids(vectors, ids)
+
+    # хранилище чанков пишется раньше индекса: наблюдатель бота
+    # перечитывает снимок, когда оба файла перестали меняться
+    write_chunk_store(CHUNKS_DB_FILE, chunks)
+    write_index_atomic(index, INDEX_FILE)
+    write_json_atomic(
+        STATE_FILE,
+        {
+            "index": spec,
+            "ids": {str(k): v for k, v in new_state.items()},
+        },
+    )
+    save_embeddings_cache(cache, keep=set(new_state.values()), embedder=spec["embedder"])
 
     print("\n✅ FAISS READY")
-    print(f"INDEX: {INDEX_FILE}")
-    print(f"CHUNKS: {len(chunks)}")
+    print(f"INDEX: {INDEX_FILE} ({spec['type']})")
+    print(f"CHUNK STORE: {CHUNKS_DB_FILE}")
+    print(f"CHUNKS: {len(chunks)} (vectors: {index.ntotal})")
 
 
 if __name__ == "__main__":
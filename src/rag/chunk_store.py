@@ -0,0 +1,396 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from rag.scope import KNOWLEDGE_ROOT, Scope, department_of
+
+
+# Колонки, которые хранятся отдельно; остальные поля чанка — в extra (JSON)
+COLUMNS = ("text", "source", "source_file", "page", "section")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id          INTEGER PRIMARY KEY,
+    text        TEXT NOT NULL,
+    source      TEXT,
+    source_file TEXT,
+    page        INTEGER,
+    section     TEXT,
+    extra       TEXT
+);
+"""
+
+# Все места, где встречается текст чанка: сам чанк и его копии
+# (rag/dedup.py). По ней фильтруется поиск по области (rag/scope.py)
+SOURCES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunk_sources (
+    id          INTEGER NOT NULL,
+    source      TEXT,
+    source_file TEXT,
+    page        INTEGER,
+    section     TEXT
+);
+CREATE INDEX IF NOT EXISTS chunk_sources_id ON chunk_sources(id);
+"""
+
+# Полнотекстовый (BM25) индекс по тем же строкам, без копии текста.
+# unicode61 приводит регистр и для кириллицы, remove_diacritics 2 — «ё» = «е»
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE chunks_fts USING fts5(
+    text,
+    section,
+    source_file,
+    content='chunks',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild');
+"""
+
+# Веса колонок в bm25(): совпадение в заголовке раздела весит больше
+FTS_WEIGHTS = (1.0, 2.0, 1.0)
+
+# Больше слов из запроса в MATCH не берём — длинные вопросы не нужны целиком
+FTS_MAX_TERMS = 32
+
+# Сколько байт файла отдавать под mmap: страницы читаются из page cache
+# и делятся между процессами, а не копируются в память каждого воркера
+CHUNK_STORE_MMAP_BYTES = 256 * 1024 * 1024
+
+# Лимит параметров в одном запросе SQLite (старые сборки — 999)
+_MAX_VARS = 900
+
+
+# =====================================================
+# WRITE (build_faiss.py)
+# =====================================================
+
+def write_chunk_store(path: Path, chunks: Iterable[Dict[str, Any]]) -> int:
+    """
+    Пишет чанки в SQLite-файл рядом и атомарно подменяет старый.
+
+    Читатели, уже открывшие старый файл, дочитывают его без ошибок:
+    после os.replace их дескриптор указывает на прежний inode.
+    """
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    if tmp.exists():
+        tmp.unlink()
+
+    conn = sqlite3.connect(str(tmp))
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.executescript(SCHEMA)
+        conn.executescript(SOURCES_SCHEMA)
+
+        rows = []
+        refs = []
+        for ch in chunks:
+            extra = {k: v for k, v in ch.items() if k != "id" and k not in COLUMNS}
+            rows.append((
+                ch["id"],
+                ch["text"],
+                ch.get("source"),
+                ch.get("source_file"),
+                ch.get("page"),
+                ch.get("section"),
+                json.dumps(extra, ensure_ascii=False) if extra else None,
+            ))
+            for ref in [ch] + list(ch.get("copies") or []):
+                refs.append((
+                    ch["id"],
+                    ref.get("source"),
+                    ref.get("source_file"),
+                    ref.get("page"),
+                    ref.get("section"),
+                ))
+
+        conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.executemany("INSERT INTO chunk_sources VALUES (?, ?, ?, ?, ?)", refs)
+
+        try:
+            conn.executescript(FTS_SCHEMA)
+        except sqlite3.OperationalError:
+            # SQLite собран без FTS5 — будет только векторный поиск
+            logging.warning("SQLite has no FTS5, lexical index is not built")
+
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+    os.replace(tmp, path)
+    return len(rows)
+
+
+# =====================================================
+# READ (бот)
+# =====================================================
+
+def fts_query(text: str) -> str:
+    """
+    Запрос пользователя -> выражение MATCH для FTS5.
+
+    Каждое слово берётся в кавычки (никакого синтаксиса FTS от пользователя),
+    слова объединяются через OR — ранжирует bm25(). Коды вида «1002345-01»
+    разбиваются на части так же, как при индексации.
+    """
+    terms = []
+    for token in re.findall(r"\w+", text.lower()):
+        if len(token) < 2 and not token.isdigit():
+            continue
+        if token not in terms:
+            terms.append(token)
+
+    return " OR ".join(f'"{t}"' for t in terms[:FTS_MAX_TERMS])
+
+
+def _like_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def scope_where(scope: Scope) -> Tuple[str, List[Any]]:
+    """
+    Условие WHERE по колонкам source / source_file / page / section
+    (таблица chunk_sources или chunks) и его параметры.
+    """
+    clauses: List[str] = []
+    params: List[Any] = []
+
+    if scope.department:
+        clauses.append("source LIKE ? ESCAPE '\\'")
+        params.append(f"%{KNOWLEDGE_ROOT}/{_like_escape(scope.department)}/%")
+    if scope.document:
+        clauses.append("(source_file = ? OR source = ?)")
+        params.extend([scope.document, scope.document])
+    if scope.section:
+        clauses.append("section LIKE ? ESCAPE '\\'")
+        params.append(f"{_like_escape(scope.section)}%")
+    if scope.file_type:
+        clauses.append("lower(source_file) LIKE ? ESCAPE '\\'")
+        params.append(f"%.{_like_escape(scope.file_type.lower().lstrip('.'))}")
+    if scope.pages:
+        clauses.append("page BETWEEN ? AND ?")
+        params.extend(scope.pages)
+
+    return " AND ".join(clauses) or "1", params
+
+
+class SqliteChunkStore:
+    """
+    Чанки базы знаний в SQLite: поиск по id — O(log n) по первичному ключу,
+    в памяти процесса ничего не держится, открытие файла мгновенное.
+
+    Соединение только на чтение, одно на процесс, под блокировкой
+    (запросы короткие — по top_k строк).
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            f"file:{path}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(f"PRAGMA mmap_size={CHUNK_STORE_MMAP_BYTES}")
+
+        self._count = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        self.has_fts = self._has_table("chunks_fts")
+        # хранилища до схлопывания дублей — фильтруем по самим чанкам
+        self._sources_table = "chunk_sources" if self._has_table("chunk_sources") else "chunks"
+
+    def _has_table(self, name: str) -> bool:
+        return self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ?",
+            (name,),
+        ).fetchone() is not None
+
+    @staticmethod
+    def _to_chunk(row: sqlite3.Row) -> Dict[str, Any]:
+        chunk = {k: row[k] for k in COLUMNS}
+        chunk["id"] = row["id"]
+        if row["extra"]:
+            chunk.update(json.loads(row["extra"]))
+        return chunk
+
+    def get(self, chunk_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM chunks WHERE id = ?",
+                (chunk_id,),
+            ).fetchone()
+        return self._to_chunk(row) if row is not None else None
+
+    def get_many(self, ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        found: Dict[int, Dict[str, Any]] = {}
+        unique = list(dict.fromkeys(ids))
+
+        with self._lock:
+            for i in range(0, len(unique), _MAX_VARS):
+                part = unique[i:i + _MAX_VARS]
+                marks = ",".join("?" * len(part))
+                for row in self._conn.execute(
+                    f"SELECT * FROM chunks WHERE id IN ({marks})",
+                    part,
+                ):
+                    found[row["id"]] = self._to_chunk(row)
+
+        return found
+
+    def lexical_search(
+        self,
+        query: str,
+        limit: int,
+        scope: Optional[Scope] = None,
+    ) -> List[Tuple[int, float]]:
+        """BM25-поиск: [(id, score)], лучшие первыми (score — меньше лучше)."""
+        match = fts_query(query)
+        if not self.has_fts or not match:
+            return []
+
+        weights = ", ".join(str(w) for w in FTS_WEIGHTS)
+        sql = (
+            f"SELECT rowid, bm25(chunks_fts, {weights}) AS score "
+            "FROM chunks_fts WHERE chunks_fts MATCH ? "
+        )
+        params: List[Any] = [match]
+
+        if scope is not None and not scope.is_empty():
+            where, scope_params = scope_where(scope)
+            sql += f"AND rowid IN (SELECT id FROM {self._sources_table} WHERE {where}) "
+            params.extend(scope_params)
+
+        with self._lock:
+            rows = self._conn.execute(
+                sql + "ORDER BY score LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+
+        return [(row[0], row[1]) for row in rows]
+
+    def ids_in_scope(self, scope: Scope) -> List[int]:
+        """id чанков, хотя бы одно вхождение которых попадает в область."""
+        where, params = scope_where(scope)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT DISTINCT id FROM {self._sources_table} WHERE {where}",
+                params,
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def departments(self) -> List[str]:
+        """Папки отделов, из которых есть чанки."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT DISTINCT source FROM {self._sources_table}"
+            ).fetchall()
+        return sorted({d for d in (department_of(row[0]) for row in rows) if d})
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class JsonChunkStore:
+    """
+    Старый формат: весь docs.json в памяти.
+
+    Нужен, пока индекс не пересобран новым build_faiss.py.
+    Чанки с id ищутся по id, без id — по позиции в списке.
+    Полнотекстового индекса нет — поиск только векторный.
+    """
+
+    has_fts = False
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, encoding="utf-8") as f:
+            self.chunks: List[Any] = json.load(f)
+
+        self.by_id: Dict[int, Dict[str, Any]] = {
+            ch["id"]: ch
+            for ch in self.chunks
+            if isinstance(ch, dict) and "id" in ch
+        }
+
+    def get(self, chunk_id: int) -> Optional[Any]:
+        if self.by_id:
+            return self.by_id.get(chunk_id)
+        if 0 <= chunk_id < len(self.chunks):
+            return self.chunks[chunk_id]
+        return None
+
+    def get_many(self, ids: List[int]) -> Dict[int, Any]:
+        found = {}
+        for i in ids:
+            chunk = self.get(i)
+            if chunk is not None:
+                found[i] = chunk
+        return found
+
+    def lexical_search(
+        self,
+        query: str,
+        limit: int,
+        scope: Optional[Scope] = None,
+    ) -> List[Tuple[int, float]]:
+        return []
+
+    def _items(self):
+        if self.by_id:
+            return self.by_id.items()
+        return enumerate(self.chunks)
+
+    def ids_in_scope(self, scope: Scope) -> List[int]:
+        ids = []
+        for idx, ch in self._items():
+            if not isinstance(ch, dict):
+                continue
+            if scope.department and department_of(ch.get("source")) != scope.department:
+                continue
+            if scope.document and scope.document not in (ch.get("source_file"), ch.get("source")):
+                continue
+            if scope.section and not (ch.get("section") or "").startswith(scope.section):
+                continue
+            if scope.file_type and not (ch.get("source_file") or "").lower().endswith(
+                f".{scope.file_type.lower().lstrip('.')}"
+            ):
+                continue
+            if scope.pages and not (
+                ch.get("page") is not None and scope.pages[0] <= ch["page"] <= scope.pages[1]
+            ):
+                continue
+            ids.append(idx)
+        return ids
+
+    def departments(self) -> List[str]:
+        return sorted({
+            d for d in (
+                department_of(ch.get("source"))
+                for _, ch in self._items()
+                if isinstance(ch, dict)
+            ) if d
+        })
+
+    def close(self) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return len(self.by_id) if self.by_id else len(self.chunks)
+
+
+def open_chunk_store(path: Path):
+    if path.suffix == ".json":
+        logging.warning(f"Using legacy JSON chunk store {path}, rebuild the index")
+        return JsonChunkStore(path)
+    return SqliteChunkStore(path)
@@ -0,0 +1,176 @@
+"""
+Общий чанкер базы знаний: им пользуются parse_docs.py и build_faiss.py.
+
+Текст приходит блоками, которые нельзя резать посередине: абзац, строка
+таблицы, текст фигуры на слайде. Блоки жадно складываются в чанк, пока
+он влезает в бюджет токенов модели эмбеддингов. Заголовок (название
+раздела, листа, шапка таблицы) повторяется в начале каждого чанка, чтобы
+кусок был понятен без соседей. Режется только блок, который сам не влезает
+в бюджет, — сначала по предложениям, потом по словам.
+
+Бюджет — в токенах токенизатора модели эмбеддингов. Словарь
+all-MiniLM-L6-v2 английский и режет кириллицу почти посимвольно
+(~1,2 символа на токен), поэтому бюджет больше max_seq_length = 256:
+при 256 чанк вышел бы в 300 символов, а база — втрое больше прежней.
+Вектор строится по началу чанка (как и раньше, при 800 символах),
+BM25 и промпт модели получают чанк целиком.
+
+iter_chunks отдаёт чанки по мере поступления блоков и держит в памяти
+только текущий чанк — так режутся листы на сотни тысяч строк.
+"""
+
+import logging
+import os
+import re
+import threading
+from typing import Callable, Iterable, Iterator, List, Optional
+
+# Токенов на чанк: ~850 символов русского текста. Подобрано по документам
+# базы: чанков столько же, сколько давала прежняя нарезка по 800 символов
+RAG_CHUNK_TOKENS = int(os.getenv("RAG_CHUNK_TOKENS", "700"))
+
+# Токенизатор той же модели, что считает эмбеддинги
+TOKENIZER_NAME = os.getenv(
+    "RAG_CHUNK_TOKENIZER",
+    "sentence-transformers/all-MiniLM-L6-v2",
+)
+
+# Меняется вместе с правилами нарезки: parse_docs.py переразберёт все файлы
+CHUNKER_VERSION = f"blocks-1:{RAG_CHUNK_TOKENS}:{TOKENIZER_NAME}"
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?…;])\s+")
+_CYRILLIC_RE = re.compile(r"[а-яё]", re.IGNORECASE)
+_PUNCT_RE = re.compile(r"[^\w\s]")
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+_token_len: Optional[Callable[[str], int]] = None
+
+
+def _approx_len(text: str) -> int:
+    # WordPiece английской модели: кириллица — ~1,2 символа на токен,
+    # знак препинания — отдельный токен, латиница и цифры — ~4 символа
+    cyrillic = len(_CYRILLIC_RE.findall(text))
+    punct = len(_PUNCT_RE.findall(text))
+    return max(1, cyrillic * 5 // 6 + punct + (len(text) - cyrillic - punct) // 4)
+
+
+def _model_len(text: str) -> int:
+    return len(_tokenizer.encode(text, add_special_tokens=False))
+
+
+def token_len(text: str) -> int:
+    """Длина текста в токенах модели (или оценка, если токенизатора нет)."""
+    global _tokenizer, _token_len
+
+    if _token_len is None:
+        with _tokenizer_lock:
+            if _token_len is None:
+                try:
+                    from transformers import AutoTokenizer
+
+                    _tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+                    _token_len = _model_len
+                except Exception:
+                    logging.warning(
+                        f"Tokenizer {TOKENIZER_NAME} is not available, "
+                        "estimating chunk size by characters"
+                    )
+                    _token_len = _approx_len
+
+    return _token_len(text) if text else 0
+
+
+def split_paragraphs(text: str) -> List[str]:
+    """Абзацы по пустым строкам; одиночные переводы строк — внутри абзаца."""
+    parts = re.split(r"\n\s*\n", text or "")
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _split_oversized(block: str, budget: int) -> List[str]:
+    """
+    Блок длиннее бюджета -> куски не длиннее бюджета: предложения,
+    а слишком длинное предложение — группы слов. Куски потом
+    упаковываются вместе с соседними блоками.
+    """
+    pieces: List[str] = []
+    for sentence in _SENTENCE_RE.split(block):
+        if token_len(sentence) <= budget:
+            pieces.append(sentence)
+            continue
+
+        current: List[str] = []
+        for word in sentence.split():
+            candidate = " ".join(current + [word])
+            if current and token_len(candidate) > budget:
+                pieces.append(" ".join(current))
+                current = [word]
+            else:
+                current.append(word)
+        if current:
+            pieces.append(" ".join(current))
+
+    return pieces
+
+
+def _pack(blocks: Iterable[str], budget: int, sep: str) -> Iterator[str]:
+    # пробелы и переводы строк токенизатор не считает — длины просто складываются
+    current: List[str] = []
+    used = 0
+
+    for block in blocks:
+        size = token_len(block)
+        if current and used + size > budget:
+            yield sep.join(current)
+            current, used = [], 0
+        current.append(block)
+        used += size
+
+    if current:
+        yield sep.join(current)
+
+
+def iter_chunks(
+    blocks: Iterable[str],
+    header: str = "",
+    max_tokens: Optional[int] = None,
+) -> Iterator[str]:
+    """
+    Складывает неделимые блоки в чанки не длиннее max_tokens.
+
+    header повторяется первой строкой каждого чанка и входит в бюджет.
+    blocks читаются лениво, чанк отдаётся, как только он заполнен.
+    """
+    max_tokens = max_tokens or RAG_CHUNK_TOKENS
+    header = (header or "").strip()
+
+    budget = max_tokens - (token_len(header) + 1 if header else 0)
+    # заголовок-простыня не должен съесть весь бюджет
+    budget = max(budget, max_tokens // 2)
+
+    def units() -> Iterator[str]:
+        for block in blocks:
+            block = (block or "").strip()
+            if not block:
+                continue
+            if token_len(block) > budget:
+                yield from _split_oversized(block, budget)
+            else:
+                yield block
+
+    for chunk in _pack(units(), budget, sep="\n"):
+        yield f"{header}\n{chunk}" if header else chunk
+
+
+def chunk_blocks(
+    blocks: Iterable[str],
+    header: str = "",
+    max_tokens: Optional[int] = None,
+) -> List[str]:
+    """То же, что iter_chunks, но списком."""
+    return list(iter_chunks(blocks, header=header, max_tokens=max_tokens))
+
+
+def chunk_text(text: str, header: str = "", max_tokens: Optional[int] = None) -> List[str]:
+    """Чанки из сплошного текста: блоки — абзацы."""
+    return chunk_blocks(split_paragraphs(text), header=header, max_tokens=max_tokens)
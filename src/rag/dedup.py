@@ -0,0 +1,186 @@
+"""
+Схлопывание дублей чанков перед индексацией (build_faiss.py).
+
+Один и тот же регламент лежит в папках нескольких отделов, а то и в PDF
+и DOCX сразу — без схлопывания каждая копия становится отдельным
+вектором, и поиск возвращает один текст 2–3 раза в top_k.
+
+  • точные дубли — совпадает хэш нормализованного текста (регистр,
+    ё/е, пунктуация и пробелы не учитываются);
+  • почти дубли — SimHash по шинглам из трёх слов отличается не больше
+    чем на RAG_DEDUP_DISTANCE бит из 64, и числа в текстах те же
+    (таблицы с другими суммами и датами дублями не считаются).
+
+В индексе остаётся первый чанк (по пути файла), остальные вхождения
+записываются ему в "copies" — бот называет их в контексте для модели.
+"""
+
+import hashlib
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Схлопывать дубли при сборке индекса
+RAG_DEDUP = os.getenv("RAG_DEDUP", "1") == "1"
+
+# Порог почти-дублей: бит из 64 (одно слово на чанк в 120 слов — около 4,
+# несвязанные тексты — 20+), < 0 — только точные дубли
+RAG_DEDUP_DISTANCE = int(os.getenv("RAG_DEDUP_DISTANCE", "6"))
+
+# Короче — только точное совпадение: SimHash пары фраз ненадёжен
+RAG_DEDUP_MIN_WORDS = int(os.getenv("RAG_DEDUP_MIN_WORDS", "8"))
+
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3
+
+REF_FIELDS = ("source", "source_file", "page", "section")
+
+_WORD_RE = re.compile(r"\w+")
+_NUMBER_RE = re.compile(r"\d+")
+
+
+# =====================================================
+# FINGERPRINTS
+# =====================================================
+
+def normalize_words(text: str) -> List[str]:
+    return _WORD_RE.findall((text or "").lower().replace("ё", "е"))
+
+
+def content_hash(words: List[str]) -> str:
+    return hashlib.sha1(" ".join(words).encode("utf-8")).hexdigest()
+
+
+def _feature_hash(feature: str) -> int:
+    digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def simhash(words: List[str]) -> int:
+    """64-битный SimHash по шинглам из SHINGLE_SIZE слов."""
+    if len(words) < SHINGLE_SIZE:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [
+            " ".join(words[i:i + SHINGLE_SIZE])
+            for i in range(len(words) - SHINGLE_SIZE + 1)
+        ]
+
+    # бит отпечатка — голосование хэшей шинглов по этому биту;
+    # столбцы двоичных строк считаются в C, без цикла по битам в Python
+    rows = [format(_feature_hash(s), "064b") for s in shingles]
+    half = len(rows) / 2
+
+    fingerprint = 0
+    for column in zip(*rows):
+        fingerprint = fingerprint << 1 | (column.count("1") > half)
+    return fingerprint
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _bands(fingerprint: int, n: int) -> List[Tuple[int, int]]:
+    """
+    Делим отпечаток на n полос. Если расстояние меньше n, хотя бы
+    одна полоса совпадает целиком — кандидаты ищутся по полосам.
+    """
+    width = SIMHASH_BITS // n
+    bands = []
+    for i in range(n):
+        bits = width if i < n - 1 else SIMHASH_BITS - width * (n - 1)
+        bands.append((i, fingerprint >> (i * width) & ((1 << bits) - 1)))
+    return bands
+
+
+# =====================================================
+# COLLAPSE
+# =====================================================
+
+def source_ref(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: chunk.get(k) for k in REF_FIELDS}
+
+
+class _Index:
+    """Уже оставленные чанки: по хэшу текста и по полосам SimHash."""
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max_distance
+        self.by_hash: Dict[str, Dict[str, Any]] = {}
+        self.bands: Dict[Tuple[int, int], List[int]] = {}
+        self.near: List[Tuple[int, Tuple[str, ...], Dict[str, Any]]] = []
+
+    def find(self, words: List[str]) -> Tuple[Optional[Dict[str, Any]], str, Optional[tuple]]:
+        h = content_hash(words)
+        found = self.by_hash.get(h)
+        if found is not None:
+            return found, h, None
+
+        if self.max_distance < 0 or len(words) < RAG_DEDUP_MIN_WORDS:
+            return None, h, None
+
+        fp = simhash(words)
+        numbers = tuple(sorted(w for w in words if _NUMBER_RE.fullmatch(w)))
+        seen = set()
+        for band in _bands(fp, self.max_distance + 1):
+            for pos in self.bands.get(band, ()):
+                if pos in seen:
+                    continue
+                seen.add(pos)
+                other_fp, other_numbers, chunk = self.near[pos]
+                if other_numbers == numbers and hamming(fp, other_fp) <= self.max_distance:
+                    return chunk, h, None
+
+        return None, h, (fp, numbers)
+
+    def add(self, chunk: Dict[str, Any], h: str, near: Optional[tuple]) -> None:
+        self.by_hash[h] = chunk
+        if near is None:
+            return
+        fp, numbers = near
+        pos = len(self.near)
+        self.near.append((fp, numbers, chunk))
+        for band in _bands(fp, self.max_distance + 1):
+            self.bands.setdefault(band, []).append(pos)
+
+
+def collapse_duplicates(
+    chunks: List[Dict[str, Any]],
+    max_distance: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Оставляет по одному чанку на группу дублей (первый по порядку).
+
+    Остальные вхождения дописываются оставленному в "copies" —
+    без повторов и без ссылки на само себя. Возвращает (чанки, сколько
+    схлопнуто).
+    """
+    if max_distance is None:
+        max_distance = RAG_DEDUP_DISTANCE
+
+    index = _Index(max_distance)
+    kept: List[Dict[str, Any]] = []
+    merged = 0
+
+    for ch in chunks:
+        ch.pop("copies", None)
+        words = normalize_words(ch.get("text"))
+        canonical, h, near = index.find(words)
+
+        if canonical is None:
+            index.add(ch, h, near)
+            kept.append(ch)
+            continue
+
+        merged += 1
+        ref = source_ref(ch)
+        copies = canonical.setdefault("copies", [])
+        if ref != source_ref(canonical) and ref not in copies:
+            copies.append(ref)
+
+    for ch in kept:
+        if not ch.get("copies"):
+            ch.pop("copies", None)
+
+    return kept, merged
@@ -0,0 +1,251 @@
+"""
+Бэкенды эмбеддингов для RAG.
+
+Одна и та же модель (all-MiniLM-L6-v2) в нескольких вариантах:
+  torch      — SentenceTransformer как есть (эталон);
+  torch-int8 — то же, Linear-слои динамически квантованы в int8;
+  onnx       — экспорт в ONNX, ONNX Runtime на CPU;
+  onnx-int8  — ONNX с int8-весами (quantize_dynamic).
+
+Пулинг (mean по attention mask) и нормализация повторяют пайплайн
+SentenceTransformer, поэтому векторы совместимы с индексом, собранным
+эталоном. Насколько совпадает выдача — показывает bench_embed.py.
+
+Выбор: RAG_EMBED_BACKEND. ONNX-файлы готовятся один раз:
+  PYTHONPATH=src python -m rag.embeddings --export
+"""
+
+import argparse
+import json
+import logging
+import os
+from pathlib import Path
+from typing import List, Sequence
+
+import numpy as np
+
+BASE_DIR = Path(__file__).resolve().parent
+
+EMBED_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+RAG_EMBED_MODEL = os.getenv("RAG_EMBED_MODEL", "all-MiniLM-L6-v2")
+RAG_EMBED_BACKEND = os.getenv("RAG_EMBED_BACKEND", "torch")
+
+# Папка с model.onnx / model.int8.onnx, токенизатором и embedder.json
+RAG_ONNX_DIR = Path(os.getenv("RAG_ONNX_DIR", str(BASE_DIR / "onnx")))
+
+# Потоки ONNX Runtime (на маленьком инстансе Render больше 1–2 не нужно)
+RAG_EMBED_THREADS = int(os.getenv("RAG_EMBED_THREADS", "1"))
+
+ONNX_FILE = "model.onnx"
+ONNX_INT8_FILE = "model.int8.onnx"
+CONFIG_FILE = "embedder.json"
+
+
+def embedder_id(backend: str = None, model_name: str = None) -> str:
+    """Имя варианта модели; им помечается кэш эмбеддингов build_faiss.py."""
+    return f"{model_name or RAG_EMBED_MODEL}:{backend or RAG_EMBED_BACKEND}"
+
+
+class TorchEmbedder:
+    """SentenceTransformer (по желанию — с int8-квантованием Linear-слоёв)."""
+
+    def __init__(self, model_name: str, quantize: bool = False):
+        from sentence_transformers import SentenceTransformer
+
+        self.name = embedder_id("torch-int8" if quantize else "torch", model_name)
+        self.model = SentenceTransformer(model_name, device="cpu")
+
+        if quantize:
+            import torch
+
+            self.model = torch.quantization.quantize_dynamic(
+                self.model,
+                {torch.nn.Linear},
+                dtype=torch.qint8,
+            )
+
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(
+        self,
+        texts: Sequence[str],
+        batch_size: int = 32,
+        show_progress_bar: bool = False,
+    ) -> np.ndarray:
+        vectors = self.model.encode(
+            list(texts),
+            batch_size=batch_size,
+            show_progress_bar=show_progress_bar,
+        )
+        return np.asarray(vectors, dtype="float32")
+
+
+class OnnxEmbedder:
+    """ONNX Runtime + токенизатор HF; пулинг как у SentenceTransformer."""
+
+    def __init__(self, model_dir: Path, quantized: bool = False):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(model_dir / CONFIG_FILE, encoding="utf8") as f:
+            self.config = json.load(f)
+
+        model_file = model_dir / (ONNX_INT8_FILE if quantized else ONNX_FILE)
+        if not model_file.exists():
+            raise FileNotFoundError(f"ONNX model not found: {model_file}")
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = RAG_EMBED_THREADS
+        opts.inter_op_num_threads = 1
+
+        self.name = embedder_id("onnx-int8" if quantized else "onnx", self.config["model"])
+        self.session = ort.InferenceSession(
+            str(model_file),
+            opts,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+
+    def dimension(self) -> int:
+        return int(self.config["dimension"])
+
+    def encode(
+        self,
+        texts: Sequence[str],
+        batch_size: int = 32,
+        show_progress_bar: bool = False,
+    ) -> np.ndarray:
+        texts = list(texts)
+        batches: List[np.ndarray] = []
+
+        for i in range(0, len(texts), batch_size):
+            enc = self.tokenizer(
+                texts[i:i + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.config["max_seq_length"],
+                return_tensors="np",
+            )
+            feeds = {
+                k: v.astype("int64")
+                for k, v in enc.items()
+                if k in self.input_names
+            }
+            hidden = self.session.run(None, feeds)[0]
+
+            # mean pooling по реальным токенам (без паддинга)
+            mask = enc["attention_mask"][..., None].astype("float32")
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+            if self.config.get("normalize"):
+                norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+                pooled = pooled / np.clip(norms, 1e-12, None)
+
+            batches.append(pooled.astype("float32"))
+
+        if not batches:
+            return np.zeros((0, self.dimension()), dtype="float32")
+        return np.vstack(batches)
+
+
+def load_embedder(backend: str = None, model_name: str = None, fallback: bool = True):
+    """
+    Эмбеддер по имени бэкенда (по умолчанию — RAG_EMBED_BACKEND).
+
+    Если ONNX-файлов нет или onnxruntime не установлен, а fallback=True —
+    откатываемся на torch, чтобы бот не остался без RAG из-за настройки.
+    """
+    backend = backend or RAG_EMBED_BACKEND
+    model_name = model_name or RAG_EMBED_MODEL
+
+    if backend not in EMBED_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    if backend.startswith("onnx"):
+        try:
+            return OnnxEmbedder(RAG_ONNX_DIR, quantized=backend == "onnx-int8")
+        except Exception:
+            if not fallback:
+                raise
+            logging.exception("ONNX EMBEDDER LOAD ERROR, falling back to torch")
+            backend = "torch"
+
+    return TorchEmbedder(model_name, quantize=backend == "torch-int8")
+
+
+# =====================================================
+# EXPORT
+# =====================================================
+
+def export_onnx(model_name: str, out_dir: Path, quantize: bool = True) -> None:
+    """Экспорт трансформера SentenceTransformer в ONNX (+ int8-версия)."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    st = SentenceTransformer(model_name, device="cpu")
+    transformer = st[0]
+    hf_model = transformer.auto_model.eval()
+    tokenizer = transformer.tokenizer
+
+    tokenizer.save_pretrained(str(out_dir))
+
+    sample = tokenizer(["пример текста"], return_tensors="pt")
+    input_names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+
+    dynamic_axes = {n: {0: "batch", 1: "tokens"} for n in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "tokens"}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            hf_model,
+            tuple(sample[n] for n in input_names),
+            str(out_dir / ONNX_FILE),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+
+    config = {
+        "model": model_name,
+        "dimension": st.get_sentence_embedding_dimension(),
+        "max_seq_length": st.max_seq_length,
+        "normalize": any(type(m).__name__ == "Normalize" for m in st),
+    }
+    with open(out_dir / CONFIG_FILE, "w", encoding="utf8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(
+            str(out_dir / ONNX_FILE),
+            str(out_dir / ONNX_INT8_FILE),
+            weight_type=QuantType.QInt8,
+        )
+
+    print(f"✅ ONNX model exported to {out_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Экспорт модели эмбеддингов в ONNX")
+    parser.add_argument("--export", action="store_true", help="экспортировать в ONNX")
+    parser.add_argument("--model", default=RAG_EMBED_MODEL)
+    parser.add_argument("--out", default=str(RAG_ONNX_DIR))
+    parser.add_argument("--no-int8", action="store_true", help="без int8-версии")
+    args = parser.parse_args()
+
+    if not args.export:
+        parser.print_help()
+        return
+
+    export_onnx(args.model, Path(args.out), quantize=not args.no_int8)
+
+
+if __name__ == "__main__":
+    main()
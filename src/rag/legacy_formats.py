@@ -0,0 +1,199 @@
+"""
+Чтение старых бинарных форматов Office без LibreOffice и конвертации.
+
+.doc (Word 97–2003) — текст собирается по piece table из потока
+WordDocument; .ppt (PowerPoint 97–2003) — по текстовым записям потока
+«PowerPoint Document». Оба файла — OLE-контейнеры, их читает olefile.
+
+Форматы описаны в [MS-DOC] и [MS-PPT]; здесь только то, что нужно
+для извлечения текста: без форматирования, картинок и встроенных объектов.
+"""
+
+import re
+import struct
+from pathlib import Path
+from typing import List
+
+import olefile
+
+
+# =====================================================
+# .DOC
+# =====================================================
+
+# Биты и смещения FIB ([MS-DOC] 2.5.1)
+_DOC_MAGIC = 0xA5EC
+_FIB_WHICH_TABLE = 0x0200
+_FIB_CLX_INDEX = 33          # fcClx / lcbClx в FibRgFcLcb97
+_PCD_COMPRESSED = 0x40000000
+
+# Служебные символы текста Word
+_FIELD_BEGIN, _FIELD_SEP, _FIELD_END = "\x13", "\x14", "\x15"
+_CELL_MARK = "\x07"
+
+
+def _doc_pieces(word: bytes, table: bytes) -> List[tuple]:
+    """(cp_start, cp_end, fc, compressed) для каждого куска текста."""
+    csw = struct.unpack_from("<H", word, 32)[0]
+    pos = 34 + csw * 2
+    cslw = struct.unpack_from("<H", word, pos)[0]
+    pos += 2 + cslw * 4
+    pos += 2  # cbRgFcLcb
+    fc_clx, lcb_clx = struct.unpack_from("<II", word, pos + _FIB_CLX_INDEX * 8)
+
+    clx = table[fc_clx:fc_clx + lcb_clx]
+
+    # CLX: сначала Prc (0x01) со стилями — пропускаем, затем Pcdt (0x02)
+    i = 0
+    while i < len(clx) and clx[i] == 0x01:
+        cb = struct.unpack_from("<h", clx, i + 1)[0]
+        i += 3 + cb
+
+    if i >= len(clx) or clx[i] != 0x02:
+        raise ValueError("piece table not found")
+
+    lcb = struct.unpack_from("<I", clx, i + 1)[0]
+    plc = clx[i + 5:i + 5 + lcb]
+    n = (lcb - 4) // 12
+
+    cps = struct.unpack_from(f"<{n + 1}I", plc, 0)
+    pieces = []
+    for k in range(n):
+        fc = struct.unpack_from("<I", plc, (n + 1) * 4 + k * 8 + 2)[0]
+        compressed = bool(fc & _PCD_COMPRESSED)
+        fc &= ~_PCD_COMPRESSED
+        pieces.append((cps[k], cps[k + 1], fc, compressed))
+    return pieces
+
+
+def _strip_fields(text: str) -> str:
+    """Поля Word: {инструкция | результат} -> остаётся только результат."""
+    out = []
+    stack: List[bool] = []  # True — сейчас идёт инструкция поля
+    for ch in text:
+        if ch == _FIELD_BEGIN:
+            stack.append(True)
+        elif ch == _FIELD_SEP and stack:
+            stack[-1] = False
+        elif ch == _FIELD_END and stack:
+            stack.pop()
+        elif not any(stack):
+            out.append(ch)
+    return "".join(out)
+
+
+def doc_paragraphs(path: Path) -> List[str]:
+    """Абзацы основного текста .doc (ячейки таблицы — через « | »)."""
+    with olefile.OleFileIO(str(path)) as ole:
+        word = ole.openstream("WordDocument").read()
+
+        if struct.unpack_from("<H", word, 0)[0] != _DOC_MAGIC:
+            raise ValueError("not a Word 97-2003 document")
+
+        flags = struct.unpack_from("<H", word, 0x0A)[0]
+        table_name = "1Table" if flags & _FIB_WHICH_TABLE else "0Table"
+        table = ole.openstream(table_name).read()
+
+    # ccpText — длина основного текста (без колонтитулов и сносок)
+    csw = struct.unpack_from("<H", word, 32)[0]
+    ccp_text = struct.unpack_from("<i", word, 34 + csw * 2 + 2 + 3 * 4)[0]
+
+    parts = []
+    for cp_start, cp_end, fc, compressed in _doc_pieces(word, table):
+        if cp_start >= ccp_text:
+            break
+        count = min(cp_end, ccp_text) - cp_start
+        if compressed:
+            offset = fc // 2
+            parts.append(word[offset:offset + count].decode("cp1252", errors="replace"))
+        else:
+            parts.append(word[fc:fc + count * 2].decode("utf-16-le", errors="replace"))
+
+    text = _strip_fields("".join(parts))
+    # конец последней ячейки + метка конца строки таблицы -> новая строка
+    text = text.replace(_CELL_MARK * 2, "\r").replace(_CELL_MARK, " | ")
+    text = text.replace("\x0b", "\n").replace("\x0c", "\r")
+    text = re.sub(r"[\x00-\x08\x0e-\x1f]", "", text)
+
+    paragraphs = []
+    for para in text.split("\r"):
+        para = re.sub(r"(\s*\|\s*)+$", "", para.strip())
+        if para:
+            paragraphs.append(para)
+    return paragraphs
+
+
+# =====================================================
+# .PPT
+# =====================================================
+
+# Типы записей [MS-PPT] 2.13.24
+_RT_SLIDE = 0x03EE
+_RT_MAIN_MASTER = 0x03F8
+_RT_NOTES = 0x03F0
+_RT_SLIDE_PERSIST_ATOM = 0x03F3
+_RT_SLIDE_LIST_WITH_TEXT = 0x0FF0
+_RT_TEXT_CHARS_ATOM = 0x0FA0
+_RT_TEXT_BYTES_ATOM = 0x0FA8
+
+# Внутри мастеров и заметок — «Образец заголовка» и т.п., не контент
+_PPT_SKIP = {_RT_MAIN_MASTER, _RT_NOTES}
+
+
+def _ppt_records(data: bytes, start: int, end: int):
+    """(тип, инстанс, начало тела, конец тела, контейнер ли) подряд на уровне."""
+    pos = start
+    while pos + 8 <= end:
+        ver_inst, rec_type, rec_len = struct.unpack_from("<HHI", data, pos)
+        body = pos + 8
+        body_end = min(body + rec_len, end)
+        yield rec_type, ver_inst >> 4, body, body_end, (ver_inst & 0x0F) == 0x0F
+        pos = body_end
+
+
+def _ppt_text(rec_type: int, data: bytes) -> str:
+    if rec_type == _RT_TEXT_CHARS_ATOM:
+        text = data.decode("utf-16-le", errors="replace")
+    else:
+        # TextBytesAtom — младшие байты UTF-16, то есть latin-1
+        text = data.decode("latin-1")
+    return text.replace("\r", "\n").replace("\x0b", "\n").strip()
+
+
+def ppt_slides(path: Path) -> List[List[str]]:
+    """Тексты слайдов по порядку; у каждого слайда — список фрагментов."""
+    with olefile.OleFileIO(str(path)) as ole:
+        data = ole.openstream("PowerPoint Document").read()
+
+    from_list: List[List[str]] = []
+    from_slides: List[List[str]] = []
+
+    def walk(start: int, end: int, in_list: bool) -> None:
+        for rec_type, inst, body, body_end, container in _ppt_records(data, start, end):
+            if rec_type in _PPT_SKIP:
+                continue
+
+            if rec_type == _RT_SLIDE_LIST_WITH_TEXT:
+                # инстанс 0 — слайды (1 — мастера, 2 — заметки)
+                if inst == 0:
+                    walk(body, body_end, True)
+                continue
+
+            if in_list and rec_type == _RT_SLIDE_PERSIST_ATOM:
+                from_list.append([])
+            elif rec_type == _RT_SLIDE:
+                from_slides.append([])
+
+            if rec_type in (_RT_TEXT_CHARS_ATOM, _RT_TEXT_BYTES_ATOM):
+                text = _ppt_text(rec_type, data[body:body_end])
+                target = from_list if in_list else from_slides
+                if text and target and text not in target[-1]:
+                    target[-1].append(text)
+            elif container:
+                walk(body, body_end, in_list)
+
+    walk(0, len(data), False)
+
+    # Обычно текст лежит в SlideListWithText; файлы новых версий PowerPoint
+    # держат его в фигурах самих слайдов
+    return from_list if any(from_list) else from_slides
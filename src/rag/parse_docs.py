@@ -1,25 +1,60 @@
+"""
+Разбор базы знаний (knowledge/4lapy_docs) в чанки для build_faiss.py.
+
+Извлечение потоковое: каждый формат — генератор, который отдаёт чанки
+по мере чтения страниц, слайдов и строк листа, а воркер сразу пишет их
+в свой шард (parsed/<хэш пути>.jsonl, JSON Lines). Итоговый docs.jsonl
+склеивается из шардов построчно, поэтому память не растёт с размером
+корпуса. Шарды неизменившихся файлов переиспользуются между запусками.
+"""
+
+import argparse
+import hashlib
+import itertools
 import json
 import os
+import re
+import shutil
+import signal
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Dict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import fitz  # PyMuPDF
 from docx import Document
+from docx.table import Table
+from docx.text.paragraph import Paragraph
 from pptx import Presentation
 from openpyxl import load_workbook
+import xlrd
+from striprtf.striprtf import rtf_to_text
+
+if __package__ in (None, ""):
+    # запуск скриптом: python src/rag/parse_docs.py
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from rag.chunking import CHUNKER_VERSION, chunk_blocks, iter_chunks
+from rag.legacy_formats import doc_paragraphs, ppt_slides
 
 
 # Корень репозитория: .../my-chatgpt-telegram-bot
 BASE_DIR = Path(__file__).resolve().parents[2]
 # Папка с оригинальными документами
 KNOWLEDGE_DIR = BASE_DIR / "knowledge" / "4lapy_docs"
-# Куда сохраняем подготовленные чанки
-OUTPUT_PATH = Path(__file__).resolve().parent / "docs.json"
+# Куда сохраняем подготовленные чанки (JSON Lines: чанк на строку)
+OUTPUT_PATH = Path(__file__).resolve().parent / "docs.jsonl"
+# Чанки каждого файла отдельно — для инкрементальных запусков
+SHARDS_DIR = Path(__file__).resolve().parent / "parsed"
+# Манифест: что и в каком виде уже разобрано (для инкрементальных запусков)
+MANIFEST_PATH = Path(__file__).resolve().parent / "manifest.json"
+# Сколько секунд даём на разбор одного файла
+PARSE_TIMEOUT_SEC = int(os.getenv("PARSE_TIMEOUT_SEC", "120"))
 
 
 def iter_files(root: Path) -> List[Path]:
     """Собираем все поддерживаемые файлы из knowledge/4lapy_docs."""
-    exts = {".pdf", ".docx", ".pptx", ".xlsx"}
+    exts = set(EXTRACTORS)
     result: List[Path] = []
     for dirpath, _, filenames in os.walk(root):
         for name in filenames:
@@ -29,137 +64,382 @@ def iter_files(root: Path) -> List[Path]:
     return result
 
 
-def chunk_text(text: str, max_chars: int = 800, overlap: int = 100) -> List[str]:
-    """Рубим длинный текст на куски для RAG."""
-    text = (text or "").strip()
-    if not text:
-        return []
-
-    if len(text) <= max_chars:
-        return [text]
-
-    chunks: List[str] = []
-    start = 0
-    length = len(text)
-
-    while start < length:
-        end = start + max_chars
-        chunk = text[start:end]
-        chunks.append(chunk.strip())
-        if end >= length:
-            break
-        start = end - overlap  # небольшое перекрытие
+def make_chunk(path: Path, text: str, page=None, section: str = "") -> Dict:
+    return {
+        "text": text,
+        "source": path.relative_to(BASE_DIR).as_posix(),
+        "source_file": path.name,
+        "page": page,
+        "section": section,
+    }
 
-    return chunks
-
-
-def extract_from_pdf(path: Path) -> List[Dict]:
-    rel = path.relative_to(BASE_DIR).as_posix()
-    out: List[Dict] = []
 
+def extract_from_pdf(path: Path) -> Iterator[Dict]:
+    # страницы читаются по одной, в памяти только текущая
     doc = fitz.open(path)
     try:
         for page_index in range(len(doc)):
             page = doc.load_page(page_index)
-            text = page.get_text("text")
-            for chunk in chunk_text(text):
-                out.append(
-                    {
-                        "text": chunk,
-                        "source": rel,
-                        "source_file": path.name,
-                        "page": page_index + 1,
-                        "section": "",
-                    }
-                )
+            # блоки PyMuPDF — абзацы/колонки в порядке чтения
+            blocks = [
+                b[4].strip()
+                for b in page.get_text("blocks", sort=True)
+                if b[6] == 0 and b[4].strip()
+            ]
+            for chunk in chunk_blocks(blocks):
+                yield make_chunk(path, chunk, page=page_index + 1)
     finally:
         doc.close()
 
-    return out
 
+def _docx_heading_level(paragraph) -> int:
+    """Уровень заголовка по стилю (Heading 1 / Заголовок 1), 0 — не заголовок."""
+    style = (paragraph.style.name or "") if paragraph.style is not None else ""
+    match = re.match(r"(?:heading|заголовок)\s*(\d+)", style.strip().lower())
+    if match:
+        return int(match.group(1))
+    if style.strip().lower() in ("title", "название"):
+        return 1
+    return 0
+
+
+def _docx_table_rows(table) -> List[str]:
+    rows = []
+    for row in table.rows:
+        cells = []
+        for cell in row.cells:
+            text = cell.text.strip()
+            # объединённые ячейки python-docx отдаёт повторно
+            if text and (not cells or cells[-1] != text):
+                cells.append(text)
+        if cells:
+            rows.append(" | ".join(cells))
+    return rows
+
+
+def extract_from_docx(path: Path) -> Iterator[Dict]:
+    doc = Document(path)
+
+    # Раздел = путь заголовков («Глава > Пункт»); чанк не переходит границу раздела
+    headings: List[str] = []
+    blocks: List[str] = []
+
+    def flush() -> List[Dict]:
+        section = " > ".join(headings)
+        chunks = [
+            make_chunk(path, chunk, section=section)
+            for chunk in chunk_blocks(blocks, header=section)
+        ]
+        blocks.clear()
+        return chunks
+
+    # абзацы и таблицы в порядке документа
+    for child in doc.element.body.iterchildren():
+        tag = child.tag.rsplit("}", 1)[-1]
+
+        if tag == "p":
+            paragraph = Paragraph(child, doc)
+            text = paragraph.text.strip()
+            if not text:
+                continue
 
-def extract_from_docx(path: Path) -> List[Dict]:
-    rel = path.relative_to(BASE_DIR).as_posix()
-    out: List[Dict] = []
+            level = _docx_heading_level(paragraph)
+            if level:
+                yield from flush()
+                del headings[level - 1:]
+                headings.append(text)
+            else:
+                blocks.append(text)
 
-    doc = Document(path)
-    paragraphs = [p.text for p in doc.paragraphs if p.text and p.text.strip()]
-    text = "\n".join(paragraphs)
-
-    for chunk in chunk_text(text):
-        out.append(
-            {
-                "text": chunk,
-                "source": rel,
-                "source_file": path.name,
-                "page": None,
-                "section": "",
-            }
-        )
-    return out
+        elif tag == "tbl":
+            rows = _docx_table_rows(Table(child, doc))
+            if not rows:
+                continue
+            # таблица — отдельные чанки, шапка повторяется в каждом
+            yield from flush()
+            section = " > ".join(headings)
+            head, body = (rows[0], rows[1:]) if len(rows) > 1 else ("", rows)
+            header = "\n".join(h for h in (section, head) if h)
+            for chunk in chunk_blocks(body, header=header):
+                yield make_chunk(path, chunk, section=section)
 
+    yield from flush()
 
-def extract_from_pptx(path: Path) -> List[Dict]:
-    rel = path.relative_to(BASE_DIR).as_posix()
-    out: List[Dict] = []
 
+def extract_from_pptx(path: Path) -> Iterator[Dict]:
     prs = Presentation(path)
     for slide_index, slide in enumerate(prs.slides, start=1):
-        texts = []
+        title_shape = slide.shapes.title
+        title = title_shape.text.strip() if title_shape is not None else ""
+
+        blocks = []
         for shape in slide.shapes:
-            if hasattr(shape, "text"):
+            if shape is title_shape:
+                continue
+            if getattr(shape, "has_table", False):
+                for row in shape.table.rows:
+                    cells = [c.text.strip() for c in row.cells if c.text.strip()]
+                    if cells:
+                        blocks.append(" | ".join(cells))
+            elif hasattr(shape, "text"):
                 t = shape.text.strip()
                 if t:
-                    texts.append(t)
-        if not texts:
+                    blocks.append(t)
+
+        if not blocks and not title:
             continue
-        text = "\n".join(texts)
-        for chunk in chunk_text(text):
-            out.append(
-                {
-                    "text": chunk,
-                    "source": rel,
-                    "source_file": path.name,
-                    "page": slide_index,
-                    "section": "",
-                }
-            )
-    return out
-
-
-def extract_from_xlsx(path: Path) -> List[Dict]:
-    rel = path.relative_to(BASE_DIR).as_posix()
-    out: List[Dict] = []
 
-    wb = load_workbook(path, data_only=True)
+        # слайд — граница чанка; заголовок слайда повторяется в каждом
+        for chunk in chunk_blocks(blocks or [title], header=title if blocks else ""):
+            yield make_chunk(path, chunk, page=slide_index, section=title)
+
+
+def _sheet_chunks(path: Path, title: str, rows: Iterable) -> Iterator[Dict]:
+    """Чанки листа таблицы: rows — строки как последовательности значений."""
+    rows_text = (
+        " | ".join(values)
+        for values in (
+            [str(v).strip() for v in row if v not in (None, "") and str(v).strip()]
+            for row in rows
+        )
+        if values
+    )
+
+    first = next(rows_text, None)
+    if first is None:
+        return
+    second = next(rows_text, None)
+
+    # строка таблицы не режется; лист и шапка — в каждом чанке
+    header = f"Лист: {title}"
+    if second is None:
+        body: Iterable[str] = [first]
+    else:
+        header += f"\n{first}"
+        body = itertools.chain([second], rows_text)
+
+    for chunk in iter_chunks(body, header=header):
+        yield make_chunk(path, chunk, section=title)
+
+
+def extract_from_xlsx(path: Path) -> Iterator[Dict]:
+    # read_only: строки читаются из XML потоком, лист целиком не строится
+    wb = load_workbook(path, read_only=True, data_only=True)
     try:
         for sheet in wb.worksheets:
-            rows_text = []
-            for row in sheet.iter_rows():
-                values = [str(c.value).strip() for c in row if c.value not in (None, "")]
-                if values:
-                    rows_text.append(" | ".join(values))
-            if not rows_text:
-                continue
-            text = f"Лист: {sheet.title}\n" + "\n".join(rows_text)
-            for chunk in chunk_text(text):
-                out.append(
-                    {
-                        "text": chunk,
-                        "source": rel,
-                        "source_file": path.name,
-                        "page": None,
-                        "section": sheet.title,
-                    }
-                )
+            # размеры листа в файле бывают неверными — читаем до конца
+            sheet.reset_dimensions()
+            yield from _sheet_chunks(path, sheet.title, sheet.iter_rows(values_only=True))
     finally:
         wb.close()
 
-    return out
+
+# =====================================================
+# LEGACY FORMATS (.doc / .xls / .ppt / .rtf)
+# =====================================================
+
+def _line_blocks(text: str) -> List[str]:
+    return [line.strip() for line in (text or "").splitlines() if line.strip()]
+
+
+def extract_from_doc(path: Path) -> Iterator[Dict]:
+    for chunk in iter_chunks(doc_paragraphs(path)):
+        yield make_chunk(path, chunk)
+
+
+def extract_from_xls(path: Path) -> Iterator[Dict]:
+    book = xlrd.open_workbook(str(path), on_demand=True)
+    try:
+        for index in range(book.nsheets):
+            sheet = book.sheet_by_index(index)
+            rows = (sheet.row_values(r) for r in range(sheet.nrows))
+            yield from _sheet_chunks(path, sheet.name, rows)
+            book.unload_sheet(index)
+    finally:
+        book.release_resources()
+
+
+def extract_from_ppt(path: Path) -> Iterator[Dict]:
+    for slide_index, texts in enumerate(ppt_slides(path), start=1):
+        if not texts:
+            continue
+        # первый фрагмент слайда — как правило, заголовок
+        title = texts[0].splitlines()[0]
+        for chunk in chunk_blocks(texts):
+            yield make_chunk(path, chunk, page=slide_index, section=title)
+
+
+def extract_from_rtf(path: Path) -> Iterator[Dict]:
+    raw = path.read_bytes().decode("latin-1")
+
+    # \'xx в RTF — байты в кодировке документа (\ansicpg1251 у русских файлов)
+    match = re.search(r"\\ansicpg(\d+)", raw[:4096])
+    encoding = f"cp{match.group(1)}" if match else "cp1252"
+
+    text = rtf_to_text(raw, encoding=encoding, errors="replace")
+    for chunk in iter_chunks(_line_blocks(text)):
+        yield make_chunk(path, chunk)
+
+
+# Расширение файла -> генератор чанков
+EXTRACTORS: Dict[str, Callable[[Path], Iterator[Dict]]] = {
+    ".pdf": extract_from_pdf,
+    ".docx": extract_from_docx,
+    ".pptx": extract_from_pptx,
+    ".xlsx": extract_from_xlsx,
+    ".doc": extract_from_doc,
+    ".xls": extract_from_xls,
+    ".ppt": extract_from_ppt,
+    ".rtf": extract_from_rtf,
+}
+
+
+# =====================================================
+# MANIFEST (инкрементальная пересборка)
+# =====================================================
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_manifest() -> Dict[str, Dict]:
+    if not MANIFEST_PATH.exists():
+        return {}
+    with open(MANIFEST_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def shard_path(rel: str) -> Path:
+    """Шард с чанками одного файла базы знаний."""
+    name = hashlib.sha1(rel.encode("utf-8")).hexdigest()[:16]
+    return SHARDS_DIR / f"{name}.jsonl"
+
+
+def write_json_atomic(path: Path, data) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def write_jsonl_atomic(path: Path, records: Iterable[Dict]) -> int:
+    """Пишет записи по одной строке JSON; возвращает их число."""
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    count = 0
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False))
+                f.write("\n")
+                count += 1
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, path)
+    return count
+
+
+def merge_shards(rels: Iterable[str], path: Path) -> int:
+    """Склеивает шарды в один JSON Lines построчно; возвращает число чанков."""
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    count = 0
+    with open(tmp, "w", encoding="utf-8") as out:
+        for rel in rels:
+            with open(shard_path(rel), encoding="utf-8") as f:
+                for line in f:
+                    out.write(line)
+                    count += 1
+    os.replace(tmp, path)
+    return count
+
+
+def is_unchanged(path: Path, entry: Optional[Dict]) -> Tuple[bool, Dict]:
+    """
+    Сверяет файл с записью манифеста.
+
+    Быстрая проверка — mtime и размер; если они поменялись,
+    сравниваем sha256 (файл могли просто перезаписать тем же содержимым).
+    """
+    st = path.stat()
+    info = {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+    if entry and entry.get("mtime_ns") == info["mtime_ns"] and entry.get("size") == info["size"]:
+        info["sha256"] = entry.get("sha256")
+        return True, info
+
+    info["sha256"] = file_sha256(path)
+    return bool(entry) and entry.get("sha256") == info["sha256"], info
+
+
+# =====================================================
+# PARALLEL EXTRACTION
+# =====================================================
+
+class ExtractTimeout(Exception):
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise ExtractTimeout()
+
+
+def extract_file(path_str: str, timeout: int = 0) -> Tuple[str, int, Optional[str]]:
+    """
+    Выполняется в процессе пула: (rel, число чанков, ошибка).
+
+    Чанки пишутся в шард файла по мере извлечения, в родительский процесс
+    возвращается только счётчик. timeout — лимит на файл в секундах
+    (SIGALRM в процессе-воркере): битый или огромный файл не держит весь
+    разбор. Долгий вызов внутри C-библиотеки прерывается, как только
+    управление вернётся в Python.
+    """
+    path = Path(path_str)
+    rel = path.relative_to(BASE_DIR).as_posix()
+
+    extractor = EXTRACTORS.get(path.suffix.lower())
+    if extractor is None:
+        return rel, 0, None
+
+    use_alarm = timeout > 0 and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.alarm(timeout)
+
+    try:
+        return rel, write_jsonl_atomic(shard_path(rel), extractor(path)), None
+    except ExtractTimeout:
+        return rel, 0, f"timeout after {timeout}s"
+    except Exception as e:
+        return rel, 0, str(e)
+    finally:
+        if use_alarm:
+            signal.alarm(0)
 
 
 def main():
-    all_chunks: List[Dict] = []
+    parser = argparse.ArgumentParser(description="Разбор базы знаний в docs.jsonl")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="число процессов для разбора файлов",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="игнорировать манифест и разобрать всё заново",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        default=PARSE_TIMEOUT_SEC,
+        help="лимит на разбор одного файла, секунд (0 — без лимита)",
+    )
+    args = parser.parse_args()
 
     if not KNOWLEDGE_DIR.exists():
         raise SystemExit(f"Knowledge directory not found: {KNOWLEDGE_DIR}")
@@ -167,31 +447,60 @@ def main():
     files = iter_files(KNOWLEDGE_DIR)
     print(f"Found {len(files)} source files under {KNOWLEDGE_DIR}")
 
-    for path in files:
-        print(f"Processing {path}")
-        suffix = path.suffix.lower()
-        try:
-            if suffix == ".pdf":
-                chunks = extract_from_pdf(path)
-            elif suffix == ".docx":
-                chunks = extract_from_docx(path)
-            elif suffix == ".pptx":
-                chunks = extract_from_pptx(path)
-            elif suffix == ".xlsx":
-                chunks = extract_from_xlsx(path)
-            else:
-                chunks = []
-        except Exception as e:
-            print(f"Error while processing {path}: {e}")
-            continue
+    manifest = {} if args.full else load_manifest()
+    if args.full and SHARDS_DIR.exists():
+        shutil.rmtree(SHARDS_DIR)
+    SHARDS_DIR.mkdir(parents=True, exist_ok=True)
 
-        all_chunks.extend(chunks)
+    new_manifest: Dict[str, Dict] = {}
+    to_parse: List[Path] = []
 
+    for path in files:
+        rel = path.relative_to(BASE_DIR).as_posix()
+        unchanged, info = is_unchanged(path, manifest.get(rel))
+        info["chunker"] = CHUNKER_VERSION
+        new_manifest[rel] = info
+
+        # поменялись правила нарезки — старые чанки не годятся
+        unchanged = unchanged and manifest[rel].get("chunker") == CHUNKER_VERSION
+
+        if unchanged and shard_path(rel).exists():
+            info["chunks"] = manifest[rel].get("chunks", 0)
+        else:
+            to_parse.append(path)
+
+    removed = set(manifest) - set(new_manifest)
+    print(
+        f"Unchanged: {len(files) - len(to_parse)}, "
+        f"to parse: {len(to_parse)}, removed: {len(removed)}"
+    )
+
+    if to_parse:
+        workers = max(1, min(args.workers, len(to_parse)))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(extract_file, str(p), args.timeout) for p in to_parse]
+            for fut in as_completed(futures):
+                rel, count, error = fut.result()
+                if error:
+                    print(f"Error while processing {rel}: {error}")
+                    # не запоминаем файл, чтобы попробовать его снова в следующий раз
+                    new_manifest.pop(rel, None)
+                    continue
+                print(f"Processed {rel}: {count} chunks")
+                new_manifest[rel]["chunks"] = count
+
+    # шарды удалённых и неразобранных файлов больше не нужны
+    keep = {shard_path(rel).name for rel in new_manifest}
+    for shard in SHARDS_DIR.glob("*.jsonl"):
+        if shard.name not in keep:
+            shard.unlink()
+
+    # Порядок чанков стабилен: по пути файла
     OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
-        json.dump(all_chunks, f, ensure_ascii=False, indent=2)
+    total = merge_shards(sorted(new_manifest), OUTPUT_PATH)
+    write_json_atomic(MANIFEST_PATH, new_manifest)
 
-    print(f"Saved {len(all_chunks)} chunks to {OUTPUT_PATH}")
+    print(f"Saved {total} chunks to {OUTPUT_PATH}")
 
 
 if __name__ == "__main__":
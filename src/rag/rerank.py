@@ -0,0 +1,161 @@
+"""
+Переранжирование кандидатов RAG кросс-энкодером и порог релевантности.
+
+Кросс-энкодер смотрит на пару (вопрос, текст чанка) целиком и оценивает
+релевантность точнее, чем расстояние между эмбеддингами. Он медленнее,
+поэтому видит только кандидатов после FAISS + BM25, все пары батча
+считаются одним вызовом predict.
+
+Порог подбирается по размеченным парам:
+  PYTHONPATH=src python -m rag.rerank --calibrate pairs.jsonl
+где в каждой строке {"query": ..., "text": ..., "relevant": true|false}.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Многоязычная модель (mMARCO): вопросы сотрудников — на русском
+RAG_RERANK_MODEL = os.getenv(
+    "RAG_RERANK_MODEL",
+    "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1",
+)
+
+# Кандидатов на переранжирование на один запрос
+RAG_RERANK_CANDIDATES = int(os.getenv("RAG_RERANK_CANDIDATES", "20"))
+
+# Порог релевантности после сигмоиды (0..1); всё, что ниже, отбрасывается
+RAG_RERANK_THRESHOLD = float(os.getenv("RAG_RERANK_THRESHOLD", "0.3"))
+
+RAG_RERANK_BATCH_SIZE = int(os.getenv("RAG_RERANK_BATCH_SIZE", "32"))
+
+_MODEL = None
+_MODEL_LOCK = threading.Lock()
+_FAILED = False
+
+
+def _sigmoid(x: float) -> float:
+    return 1.0 / (1.0 + math.exp(-x))
+
+
+def load_reranker() -> bool:
+    """Загружает кросс-энкодер один раз; False — переранжирования не будет."""
+    global _MODEL, _FAILED
+
+    if _MODEL is not None:
+        return True
+    if _FAILED:
+        return False
+
+    with _MODEL_LOCK:
+        if _MODEL is None and not _FAILED:
+            try:
+                from sentence_transformers import CrossEncoder
+
+                _MODEL = CrossEncoder(RAG_RERANK_MODEL, device="cpu")
+                logging.info(f"Reranker loaded: {RAG_RERANK_MODEL}")
+            except Exception:
+                logging.exception("RERANKER LOAD ERROR")
+                _FAILED = True
+
+    return _MODEL is not None
+
+
+def is_loaded() -> bool:
+    return _MODEL is not None
+
+
+def score_pairs(pairs: Sequence[Tuple[str, str]]) -> List[float]:
+    """Релевантность пар (вопрос, текст) в диапазоне 0..1."""
+    if not pairs:
+        return []
+
+    logits = _MODEL.predict(
+        list(pairs),
+        batch_size=RAG_RERANK_BATCH_SIZE,
+        show_progress_bar=False,
+    )
+    return [_sigmoid(float(x)) for x in logits]
+
+
+def rerank(
+    queries: Sequence[str],
+    candidates: Sequence[Sequence[Dict]],
+    top_k: int,
+    threshold: Optional[float] = None,
+) -> List[List[Dict]]:
+    """
+    Переранжирует кандидатов всех запросов батча одним вызовом модели.
+
+    У каждого результата появляется поле "rerank"; остаются только те,
+    что не ниже порога, не больше top_k, по убыванию rerank.
+    """
+    if threshold is None:
+        threshold = RAG_RERANK_THRESHOLD
+
+    pairs = [
+        (query, cand.get("text") or "")
+        for query, cands in zip(queries, candidates)
+        for cand in cands
+    ]
+    scores = iter(score_pairs(pairs))
+
+    out: List[List[Dict]] = []
+    for cands in candidates:
+        scored = [{**cand, "rerank": next(scores)} for cand in cands]
+        kept = [r for r in scored if r["rerank"] >= threshold]
+        kept.sort(key=lambda r: r["rerank"], reverse=True)
+
+        for rank, r in enumerate(kept[:top_k], start=1):
+            r["rank"] = rank
+        out.append(kept[:top_k])
+
+    return out
+
+
+# =====================================================
+# CALIBRATION
+# =====================================================
+
+def calibrate(path: str) -> Tuple[float, float]:
+    """Порог с лучшим F1 на размеченных парах: (threshold, f1)."""
+    with open(path, encoding="utf8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+
+    scores = score_pairs([(r["query"], r["text"]) for r in rows])
+    labels = [bool(r["relevant"]) for r in rows]
+    positives = sum(labels)
+
+    best = (RAG_RERANK_THRESHOLD, 0.0)
+    for threshold in sorted(set(round(s, 3) for s in scores)):
+        tp = sum(1 for s, y in zip(scores, labels) if s >= threshold and y)
+        fp = sum(1 for s, y in zip(scores, labels) if s >= threshold and not y)
+        if tp == 0:
+            continue
+        precision = tp / (tp + fp)
+        recall = tp / positives
+        f1 = 2 * precision * recall / (precision + recall)
+        if f1 > best[1]:
+            best = (threshold, f1)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Калибровка порога кросс-энкодера")
+    parser.add_argument("--calibrate", required=True, help="jsonl с размеченными парами")
+    args = parser.parse_args()
+
+    if not load_reranker():
+        raise SystemExit("Reranker model is not available")
+
+    threshold, f1 = calibrate(args.calibrate)
+    print(f"RAG_RERANK_THRESHOLD={threshold}  (F1={f1:.3f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Область поиска по базе знаний.
+
+База разложена по папкам отделов (knowledge/4lapy_docs/Касса, ТСД,
+Приёмка, SAP+ERP, ...). Вопрос можно ограничить отделом, документом,
+разделом, типом файла и диапазоном страниц — тогда FAISS ищет только
+среди чанков области (IDSelector), а BM25 — только среди её строк.
+
+Подсказка от пользователя: хэштег отдела в вопросе (#касса, #тсд,
+#весовой_товар) или команда /scope, которая запоминает отдел для чата.
+"""
+
+import re
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+# Папка базы знаний, внутри которой лежат папки отделов
+KNOWLEDGE_ROOT = "4lapy_docs"
+
+_HASHTAG_RE = re.compile(r"(?<!\w)#([\w+\-.]+)")
+
+
+class Scope(NamedTuple):
+    """
+    Фильтр поиска; пустые поля не ограничивают.
+
+    department — папка отдела как на диске («Касса», «SAP+ERP»);
+    document   — имя файла (source_file) или путь (source);
+    section    — начало пути раздела («Глава 2» найдёт «Глава 2 > Пункт 1»);
+    file_type  — расширение без точки («pdf»);
+    pages      — диапазон страниц/слайдов (с, по) включительно.
+    """
+
+    department: Optional[str] = None
+    document: Optional[str] = None
+    section: Optional[str] = None
+    file_type: Optional[str] = None
+    pages: Optional[Tuple[int, int]] = None
+
+    def is_empty(self) -> bool:
+        return not any(self)
+
+    def label(self) -> str:
+        parts = []
+        if self.department:
+            parts.append(f"отдел «{display_name(self.department)}»")
+        if self.document:
+            parts.append(f"документ «{self.document}»")
+        if self.section:
+            parts.append(f"раздел «{self.section}»")
+        if self.file_type:
+            parts.append(f"файлы .{self.file_type}")
+        if self.pages:
+            parts.append(f"стр. {self.pages[0]}–{self.pages[1]}")
+        return ", ".join(parts) or "вся база"
+
+
+def department_of(source: Optional[str]) -> Optional[str]:
+    """knowledge/4lapy_docs/Касса/x.pdf -> «Касса»."""
+    parts = (source or "").split("/")
+    if KNOWLEDGE_ROOT in parts:
+        rest = parts[parts.index(KNOWLEDGE_ROOT) + 1:]
+        # файл прямо в корне базы — без отдела
+        if len(rest) > 1:
+            return rest[0]
+    return None
+
+
+def display_name(folder: str) -> str:
+    # в именах папок пробелы заменены на «+»
+    return folder.replace("+", " ")
+
+
+def _norm(text: str) -> str:
+    text = text.lower().replace("ё", "е")
+    text = re.sub(r"[+_\-.\s]+", " ", text)
+    return text.strip()
+
+
+def resolve_department(hint: str, departments: Iterable[str]) -> Optional[str]:
+    """
+    Папка отдела по подсказке пользователя: точное совпадение без учёта
+    регистра, «+» и «_», иначе — единственный отдел, чьё имя начинается
+    с подсказки («тсд», «приемка», «весовой» -> «Весовой+товар»).
+    """
+    wanted = _norm(hint)
+    if not wanted:
+        return None
+
+    departments = list(departments)
+    for dep in departments:
+        if _norm(dep) == wanted:
+            return dep
+
+    prefixed = [dep for dep in departments if _norm(dep).startswith(wanted)]
+    if len(prefixed) == 1:
+        return prefixed[0]
+
+    return None
+
+
+def extract_scope_hint(text: str, departments: Iterable[str]) -> Tuple[str, Optional[Scope]]:
+    """
+    Ищет в тексте хэштег отдела. Возвращает (текст без хэштега, Scope)
+    или (исходный текст, None). Хэштеги, не похожие на отдел, не трогаются.
+    """
+    departments = list(departments)
+    found: List[str] = []
+
+    def replace(match: "re.Match") -> str:
+        dep = resolve_department(match.group(1), departments)
+        if dep is None:
+            return match.group(0)
+        found.append(dep)
+        return ""
+
+    cleaned = _HASHTAG_RE.sub(replace, text)
+    if not found:
+        return text, None
+
+    # несколько отделов в одном вопросе — берём первый
+    return re.sub(r"\s{2,}", " ", cleaned).strip(), Scope(department=found[0])
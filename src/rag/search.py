@@ -1,15 +1,72 @@
-import json
+import asyncio
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Set, Tuple
 
 import faiss
-from sentence_transformers import SentenceTransformer
+import numpy as np
+
+from rag import rerank
+from rag.ann import apply_search_params
+from rag.cache import TTLCache, normalize_query
+from rag.embeddings import load_embedder
+from rag.scope import Scope
+from rag.snapshot import RagSnapshot, files_version, load_snapshot
+from utils.startup import STARTUP
 
 BASE_DIR = Path(__file__).resolve().parent
 INDEX_FILE = BASE_DIR / "faiss.index"
+# Чанки по id (собирает build_faiss.py); docs.json — старый формат
+CHUNKS_DB_FILE = BASE_DIR / "chunks.sqlite3"
 DOCS_FILE = BASE_DIR / "docs.json"
 
+# Сколько потоков считают эмбеддинги и FAISS-поиск параллельно с event loop.
+# PyTorch и FAISS отпускают GIL на время вычислений, поэтому потоки
+# реально работают параллельно, а модель в памяти остаётся одна.
+RAG_WORKERS = int(os.getenv("RAG_WORKERS", "2"))
+
+# Микро-батчинг: запросы, пришедшие в пределах окна, кодируются одним батчем
+RAG_BATCH_MAX_SIZE = int(os.getenv("RAG_BATCH_MAX_SIZE", "16"))
+RAG_BATCH_WINDOW_MS = float(os.getenv("RAG_BATCH_WINDOW_MS", "5"))
+
+# Кэш эмбеддингов и результатов поиска по нормализованному запросу
+RAG_CACHE_SIZE = int(os.getenv("RAG_CACHE_SIZE", "1024"))
+RAG_CACHE_TTL = float(os.getenv("RAG_CACHE_TTL", "3600"))
+# Как часто проверять, не поменялись ли файлы индекса на диске
+# (0 — не следить, перезагрузка только командой /reload_rag)
+RAG_RELOAD_CHECK_SEC = float(os.getenv("RAG_RELOAD_CHECK_SEC", "30"))
+
+# Параметры поиска ANN-индекса (см. build_faiss.py --index-type):
+# больше — выше полнота, но медленнее; для flat не используются
+RAG_NPROBE = int(os.getenv("RAG_NPROBE", "16"))
+RAG_EF_SEARCH = int(os.getenv("RAG_EF_SEARCH", "64"))
+# Поиск по области (rag/scope.py): во сколько раз шире nprobe / efSearch —
+# векторов области в обычном числе кластеров и соседей может не хватить
+RAG_SCOPE_WIDEN = int(os.getenv("RAG_SCOPE_WIDEN", "4"))
+
+# Гибридный поиск: векторный FAISS + BM25 (FTS5 в chunks.sqlite3),
+# списки сливаются reciprocal rank fusion. Кандидатов с каждой стороны —
+# RAG_CANDIDATES (не меньше top_k); RAG_RRF_K сглаживает вклад первых мест
+RAG_HYBRID = os.getenv("RAG_HYBRID", "1") == "1"
+RAG_CANDIDATES = int(os.getenv("RAG_CANDIDATES", "20"))
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+
+# Переранжирование кандидатов кросс-энкодером с порогом релевантности
+# (модель, порог и число кандидатов — в rag/rerank.py). Выключено
+# по умолчанию: это вторая модель в памяти и лишний прогон на каждый
+# запрос — включать, когда инстанс это позволяет
+RAG_RERANK = os.getenv("RAG_RERANK", "0") == "1"
+
+# Сколько запрос ждёт, пока RAG догружается после старта бота;
+# потом отвечаем без базы знаний
+RAG_READY_WAIT_SEC = float(os.getenv("RAG_READY_WAIT_SEC", "3"))
+
+
 # Ограничим число потоков FAISS (чуть экономим память и CPU)
 try:
     faiss.omp_set_num_threads(1)
@@ -17,119 +74,597 @@ except Exception:
     # если сборка без OpenMP — просто игнорируем
     pass
 
-MODEL = SentenceTransformer("all-MiniLM-L6-v2")
+_EXECUTOR = ThreadPoolExecutor(
+    max_workers=RAG_WORKERS,
+    thread_name_prefix="rag",
+)
 
-INDEX = None
-CHUNKS: List[Dict[str, Any]] = []
-RAG_READY = False
+EMBEDDING_CACHE = TTLCache(RAG_CACHE_SIZE, RAG_CACHE_TTL)
+RESULT_CACHE = TTLCache(RAG_CACHE_SIZE, RAG_CACHE_TTL)
 
 
-def _load_index_mmap() -> None:
-    """Загрузка FAISS индекса в режиме memory-mapped.
+# ===============================================================
+# LAZY INIT
+# ===============================================================
+
+class RagNotReady(RuntimeError):
+    """RAG ещё загружается (модель или индекс)."""
 
-    Если что-то пошло не так — просто отключаем RAG
-    и даём боту работать без внутреннего поиска.
-    """
-    global INDEX, CHUNKS, RAG_READY
 
+# Модель грузится в фоне после подключения бота к Telegram:
+# импорт torch + sentence-transformers занимает десятки секунд.
+# Бэкенд (torch / onnx / int8) — RAG_EMBED_BACKEND, см. rag/embeddings.py
+_MODEL = None
+_MODEL_LOCK = threading.Lock()
+
+# idle -> loading -> ready | failed
+RAG_STATE = "idle"
+_INIT_LOCK = threading.Lock()
+_init_future = None
+
+
+def get_model():
+    global _MODEL
+
+    if _MODEL is None:
+        with _MODEL_LOCK:
+            if _MODEL is None:
+                with STARTUP.stage("rag_model"):
+                    _MODEL = load_embedder()
+                logging.info(f"Embedding backend: {_MODEL.name}")
+
+    return _MODEL
+
+
+def init_rag() -> bool:
+    """Загрузка модели и индекса (блокирующая, выполняется в пуле потоков)."""
+    global RAG_STATE
+
+    RAG_STATE = "loading"
     try:
-        if not INDEX_FILE.exists():
-            logging.error(f"FAISS index file not found: {INDEX_FILE}")
-            RAG_READY = False
-            return
+        get_model()
+        if RAG_RERANK:
+            with STARTUP.stage("rag_reranker"):
+                rerank.load_reranker()
+        with STARTUP.stage("rag_index"):
+            ok = reload_index()
+    except Exception:
+        logging.exception("RAG INIT ERROR")
+        ok = False
 
-        if not DOCS_FILE.exists():
-            logging.error(f"Docs file not found: {DOCS_FILE}")
-            RAG_READY = False
-            return
+    if not ok:
+        RAG_STATE = "failed"
+
+    logging.info(f"⏱ RAG init {RAG_STATE}: {STARTUP.report()}")
+    return ok
+
+
+def start_rag_init():
+    """Запускает init_rag() в фоне один раз; не ждёт окончания."""
+    global _init_future
+
+    with _INIT_LOCK:
+        if _init_future is None:
+            _init_future = _EXECUTOR.submit(init_rag)
+
+    return _init_future
+
+
+def rag_state() -> str:
+    return RAG_STATE
+
+
+async def wait_ready(timeout: float) -> bool:
+    """Ждёт окончания фоновой загрузки не дольше timeout секунд."""
+    start_rag_init()
 
-        logging.info(f"Loading FAISS index (mmap) from {INDEX_FILE}")
+    deadline = time.monotonic() + timeout
+    while RAG_STATE in ("idle", "loading") and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
 
-        # 🔥 Ключевой момент: используем memory-mapped режим
-        INDEX = faiss.read_index(str(INDEX_FILE), faiss.IO_FLAG_MMAP)
+    return is_ready()
+
+
+# ===============================================================
+# INDEX SNAPSHOT + HOT RELOAD
+# ===============================================================
+
+# Активный снимок базы; подменяется целиком одной операцией присваивания
+_ACTIVE: Optional[RagSnapshot] = None
+_RELOAD_LOCK = threading.Lock()
+
+_watcher: Optional[asyncio.Task] = None
+
+
+def chunks_file() -> Path:
+    """Хранилище чанков: SQLite, а если индекс собран старой версией — docs.json."""
+    return CHUNKS_DB_FILE if CHUNKS_DB_FILE.exists() else DOCS_FILE
+
+
+def reload_index() -> bool:
+    """
+    Загружает faiss.index и хранилище чанков в новый снимок, проверяет его
+    и атомарно подменяет активный. При ошибке остаётся старый снимок
+    (или RAG остаётся выключенным, если снимка ещё не было).
+    """
+    global _ACTIVE, RAG_STATE
 
-        with open(DOCS_FILE, encoding="utf-8") as f:
-            CHUNKS = json.load(f)
+    with _RELOAD_LOCK:
+        try:
+            logging.info(f"Loading FAISS index (mmap) from {INDEX_FILE}")
+            snap = load_snapshot(
+                INDEX_FILE,
+                chunks_file(),
+                dim=get_model().dimension(),
+            )
+        except Exception:
+            logging.exception("Failed to load FAISS index")
+            return False
 
-        RAG_READY = True
-        logging.info(
-            "FAISS index loaded in mmap mode. "
-            f"Chunks: {len(CHUNKS)}"
+        kind, params = apply_search_params(snap.index, RAG_NPROBE, RAG_EF_SEARCH)
+
+        _ACTIVE = snap
+        RAG_STATE = "ready"
+
+    logging.info(f"FAISS index loaded ({kind} {params}). Chunks: {len(snap)}")
+    return True
+
+
+def is_ready() -> bool:
+    return _ACTIVE is not None and _MODEL is not None
+
+
+def active_snapshot() -> Optional[RagSnapshot]:
+    return _ACTIVE
+
+
+async def areload_index() -> bool:
+    """reload_index() в пуле потоков — для хендлеров и наблюдателя."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_EXECUTOR, reload_index)
+
+
+async def _watch_index() -> None:
+    """
+    Следит за файлами индекса и перезагружает снимок после изменения.
+
+    Перезагрузка идёт, только когда версия файлов на диске отличается
+    от активной и не менялась между двумя проверками — то есть сборка
+    уже дописала оба файла.
+    """
+    last_seen = None
+    while True:
+        await asyncio.sleep(RAG_RELOAD_CHECK_SEC)
+        try:
+            disk = files_version(INDEX_FILE, chunks_file())
+            active = _ACTIVE.version if _ACTIVE is not None else None
+
+            # пока идёт первичная загрузка, init_rag() сам прочитает файлы
+            loading = RAG_STATE == "loading"
+
+            if not loading and disk != active and disk == last_seen:
+                logging.info("RAG index files changed, reloading")
+                await areload_index()
+
+            last_seen = disk
+        except Exception:
+            logging.exception("RAG WATCHER ERROR")
+
+
+def _ensure_watcher() -> None:
+    global _watcher
+
+    if RAG_RELOAD_CHECK_SEC <= 0:
+        return
+
+    loop = asyncio.get_running_loop()
+    if _watcher is not None and not _watcher.done() and _watcher.get_loop() is loop:
+        return
+
+    _watcher = loop.create_task(_watch_index())
+
+
+# ===============================================================
+# CACHE
+# ===============================================================
+
+def index_version() -> Optional[Tuple]:
+    """
+    Версия активного снимка базы знаний (mtime/размер faiss.index и хранилища чанков).
+
+    Входит в ключ кэша результатов, поэтому после перезагрузки индекса
+    старые записи перестают находиться и вытесняются по LRU/TTL.
+    """
+    snap = _ACTIVE
+    return snap.version if snap is not None else None
+
+
+def cache_stats() -> Dict[str, Any]:
+    """Счётчики попаданий/промахов кэшей RAG."""
+    return {
+        "embeddings": EMBEDDING_CACHE.stats(),
+        "results": RESULT_CACHE.stats(),
+    }
+
+
+def _encode_queries(queries: List[str]) -> np.ndarray:
+    """Эмбеддинги запросов; модель вызывается только для промахов кэша."""
+    keys = [normalize_query(q) for q in queries]
+    vectors: List[Optional[np.ndarray]] = [EMBEDDING_CACHE.get(k) for k in keys]
+
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+        encoded = get_model().encode(
+            [queries[i] for i in missing],
+            batch_size=len(missing),
         )
+        for i, vec in zip(missing, encoded):
+            vectors[i] = vec
+            EMBEDDING_CACHE.set(keys[i], vec)
+
+    return np.asarray(vectors, dtype="float32")
 
-    except Exception:
-        logging.exception("Failed to load FAISS index in mmap mode")
-        INDEX = None
-        CHUNKS = []
-        RAG_READY = False
 
+def rrf_fuse(rankings: List[List[int]], k: int = RAG_RRF_K) -> List[Tuple[int, float]]:
+    """
+    Reciprocal rank fusion: score(id) = Σ 1 / (k + rank) по всем спискам.
+
+    Шкалы у L2-расстояния и bm25 разные, поэтому сливаем по местам,
+    а не по самим значениям. Возвращает [(id, score)] по убыванию score.
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking, start=1):
+            fused[idx] = fused.get(idx, 0.0) + 1.0 / (k + rank)
 
-# Загружаем индекс при импорте модуля
-_load_index_mmap()
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
 
 
-def search(query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+def _chunk_to_result(
+    chunk: Any,
+    rank: int,
+    idx: int,
+    dist: Optional[float],
+    fused: float,
+    lexical: Optional[float],
+) -> Dict[str, Any]:
+    if isinstance(chunk, dict):
+        text = chunk.get("text")
+        source = chunk.get("source")
+        source_file = chunk.get("source_file")
+        page = chunk.get("page")
+        section = chunk.get("section")
+        # те же тексты из других файлов (rag/dedup.py)
+        copies = chunk.get("copies") or []
+    else:
+        # на всякий случай, если старый формат docs.json
+        text = str(chunk)
+        source = None
+        source_file = None
+        page = None
+        section = None
+        copies = []
+
+    return {
+        "id": idx,
+        "rank": rank,
+        "score": float(dist) if dist is not None else None,
+        "bm25": lexical,
+        "fused": fused,
+        "text": text,
+        "source": source,
+        "source_file": source_file,
+        "page": page,
+        "section": section,
+        "copies": copies,
+    }
+
+
+def _vector_search(
+    snap: RagSnapshot,
+    v: np.ndarray,
+    k: int,
+    scopes: List[Optional[Scope]],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    index.search по батчу: запросы без области — одним вызовом, запросы
+    с областью — по вызову на каждую область (с IDSelector).
+    """
+    groups: Dict[Optional[Scope], List[int]] = {}
+    for row, scope in enumerate(scopes):
+        groups.setdefault(scope if scope and not scope.is_empty() else None, []).append(row)
+
+    if list(groups) == [None]:
+        return snap.index.search(v, k)
+
+    distances = np.full((len(v), k), np.inf, dtype="float32")
+    indices = np.full((len(v), k), -1, dtype="int64")
+
+    for scope, rows in groups.items():
+        params = None
+        if scope is not None:
+            params = snap.scope_params(scope, RAG_SCOPE_WIDEN)
+            if params is None:
+                # в области нет ни одного чанка
+                continue
+
+        d, i = snap.index.search(v[rows], k, params=params)
+        distances[rows] = d
+        indices[rows] = i
+
+    return distances, indices
+
+
+def search_batch(
+    queries: List[str],
+    top_k: int = 5,
+    scopes: Optional[List[Optional[Scope]]] = None,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Поиск сразу для нескольких запросов.
+
+    Все запросы кодируются одним батчем и ищутся одним вызовом index.search
+    (запросы с областью scopes[i] — отдельным вызовом на область);
+    при RAG_HYBRID к векторным кандидатам добавляются BM25-кандидаты
+    и оба списка сливаются через rrf_fuse. Затем (RAG_RERANK) кандидаты
+    всего батча переранжируются кросс-энкодером, и нерелевантные —
+    ниже порога — отбрасываются: результат может быть пустым.
+    Возвращает список результатов в том же порядке, что и queries.
+    """
+    if not queries:
+        return []
+
+    scopes = scopes or [None] * len(queries)
+
+    # Снимок берём один раз: hot reload не затронет этот запрос
+    snap = _ACTIVE
+
+    if snap is None:
+        # Индекс не загрузился или база пуста — просто возвращаем пустые списки.
+        # Внешняя логика (chat_func.try_rag) аккуратно обработает это.
+        logging.warning("RAG search requested, but index is not ready")
+        return [[] for _ in queries]
+
+    # Векторизуем запросы одним батчем (повторные берём из кэша)
+    v = _encode_queries(queries)
+
+    hybrid = RAG_HYBRID and snap.store.has_fts
+    use_rerank = RAG_RERANK and rerank.is_loaded()
+
+    # сколько кандидатов оставить после слияния и сколько брать у каждого поиска
+    keep_k = max(top_k, rerank.RAG_RERANK_CANDIDATES) if use_rerank else top_k
+    fetch_k = max(keep_k, RAG_CANDIDATES) if hybrid else keep_k
+
+    distances, indices = _vector_search(snap, v, fetch_k, scopes)
+
+    fused_rows: List[List[Tuple[int, float]]] = []
+    dist_rows: List[Dict[int, float]] = []
+    lex_rows: List[Dict[int, float]] = []
+
+    for query, scope, row_idx, row_dist in zip(queries, scopes, indices, distances):
+        vec = {int(i): float(d) for i, d in zip(row_idx, row_dist) if i >= 0}
+        lex = dict(snap.lexical(query, fetch_k, scope)) if hybrid else {}
+
+        fused_rows.append(rrf_fuse([list(vec), list(lex)])[:keep_k])
+        dist_rows.append(vec)
+        lex_rows.append(lex)
+
+    # Тексты чанков всех запросов батча — одним обращением к хранилищу
+    chunks = snap.lookup_many([idx for row in fused_rows for idx, _ in row])
+
+    out: List[List[Dict[str, Any]]] = []
+    for fused, vec, lex in zip(fused_rows, dist_rows, lex_rows):
+        results: List[Dict[str, Any]] = []
+        for idx, score in fused:
+            chunk = chunks.get(idx)
+            if chunk is None:
+                continue
+            results.append(_chunk_to_result(
+                chunk,
+                len(results) + 1,
+                idx,
+                vec.get(idx),
+                score,
+                lex.get(idx),
+            ))
+        out.append(results)
+
+    if use_rerank:
+        out = rerank.rerank(queries, out, top_k)
+
+    return out
+
+
+def search(query: str, top_k: int = 5, scope: Optional[Scope] = None) -> List[Dict[str, Any]]:
     """
-    FAISS-поиск по внутренней базе.
+    Поиск по внутренней базе (векторный + BM25, см. search_batch).
+
+    scope — область поиска (отдел, документ, раздел, тип файла, страницы),
+    см. rag/scope.py; None — вся база.
 
     Возвращает список словарей:
     {
+        "id": int,
         "rank": int,
-        "score": float,
+        "score": float | None,   # L2-расстояние FAISS (None — нашёл только BM25)
+        "bm25": float | None,    # bm25 из FTS5 (меньше — лучше)
+        "fused": float,          # RRF-скор гибридного поиска
+        "rerank": float,         # релевантность 0..1 (если включён RAG_RERANK),
+                                 # по ней отсортировано и отфильтровано
         "text": str,
         "source": str,
         "source_file": str,
         "page": int | None,
         "section": str | None,
+        "copies": list,          # тот же текст в других файлах
     }
     """
     if not query:
         return []
 
-    if not RAG_READY or INDEX is None or not CHUNKS:
-        # Индекс не загрузился или база пуста — просто возвращаем пустой список.
-        # Внешняя логика (chat_func.try_rag) аккуратно обработает это.
-        logging.warning("RAG search requested, but index is not ready")
+    return search_batch([query], top_k, [scope])[0]
+
+
+def departments() -> List[str]:
+    """Папки отделов в активной базе (для подсказок области поиска)."""
+    snap = _ACTIVE
+    if snap is None:
         return []
+    return snap.departments()
 
-    # Векторизуем запрос
-    v = MODEL.encode([query])
-
-    distances, indices = INDEX.search(v, top_k)
-
-    results: List[Dict[str, Any]] = []
-    for rank, (idx, dist) in enumerate(zip(indices[0], distances[0]), start=1):
-        if idx < 0:
-            continue
-        if idx >= len(CHUNKS):
-            continue
-
-        chunk = CHUNKS[idx]
-
-        if isinstance(chunk, dict):
-            text = chunk.get("text")
-            source = chunk.get("source")
-            source_file = chunk.get("source_file")
-            page = chunk.get("page")
-            section = chunk.get("section")
-        else:
-            # на всякий случай, если старый формат docs.json
-            text = str(chunk)
-            source = None
-            source_file = None
-            page = None
-            section = None
-
-        results.append(
-            {
-                "rank": rank,
-                "score": float(dist),
-                "text": text,
-                "source": source,
-                "source_file": source_file,
-                "page": page,
-                "section": section,
-            }
-        )
 
-    return results
+# ===============================================================
+# MICRO-BATCHING
+# ===============================================================
+
+class _QueryBatcher:
+    """
+    Собирает запросы, пришедшие почти одновременно, в один батч.
+
+    Первый запрос в пустой очереди запускает таймер на window секунд;
+    всё, что успело прийти за это время (но не больше max_batch),
+    кодируется одним вызовом model.encode и ищется одним index.search.
+    Результаты раздаются ожидающим корутинам через futures.
+    """
+
+    def __init__(self, max_batch: int, window: float):
+        self.max_batch = max(1, max_batch)
+        self.window = max(0.0, window)
+
+        self._pending: List[Tuple[str, int, Optional[Scope], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        # event loop держит задачи только слабыми ссылками —
+        # без этого множества батч может быть собран GC посреди поиска
+        self._tasks: Set[asyncio.Task] = set()
+
+        # статистика фактических размеров батчей
+        self.batches = 0
+        self.queries = 0
+        self.max_size = 0
+        self.sizes: Counter = Counter()
+
+    async def submit(
+        self,
+        query: str,
+        top_k: int,
+        scope: Optional[Scope] = None,
+    ) -> List[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((query, top_k, scope, fut))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        size = len(batch)
+        self.batches += 1
+        self.queries += size
+        self.max_size = max(self.max_size, size)
+        self.sizes[size] += 1
+        logging.debug(f"RAG batch: {size} queries")
+
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, int, Optional[Scope], asyncio.Future]]) -> None:
+        queries = [q for q, _, _, _ in batch]
+        scopes = [s for _, _, s, _ in batch]
+        top_k = max(k for _, k, _, _ in batch)
+
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                _EXECUTOR, search_batch, queries, top_k, scopes
+            )
+        except Exception as e:
+            for _, _, _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        for (_, k, _, fut), res in zip(batch, results):
+            if not fut.done():
+                fut.set_result(res[:k])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "avg_size": round(self.queries / self.batches, 2) if self.batches else 0.0,
+            "max_size": self.max_size,
+            "sizes": dict(sorted(self.sizes.items())),
+        }
+
+
+_BATCHER = _QueryBatcher(RAG_BATCH_MAX_SIZE, RAG_BATCH_WINDOW_MS / 1000)
+
+
+def batch_stats() -> Dict[str, Any]:
+    """Фактические размеры батчей эмбеддинга с момента старта."""
+    return _BATCHER.stats()
+
+
+async def asearch(
+    query: str,
+    top_k: int = 5,
+    scope: Optional[Scope] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Асинхронный поиск по внутренней базе (scope — как в search).
+
+    Эмбеддинг запроса и FAISS-поиск выполняются в пуле потоков,
+    поэтому event loop Telethon не блокируется на время расчёта.
+    Одновременные запросы склеиваются в микро-батчи (см. _QueryBatcher),
+    повторные — отдаются из кэша без обращения к модели.
+    """
+    if not query:
+        return []
+
+    _ensure_watcher()
+
+    if not is_ready() and not await wait_ready(RAG_READY_WAIT_SEC):
+        if RAG_STATE == "failed":
+            # индекса нет или он битый — ведём себя как пустая база
+            return []
+        raise RagNotReady(f"RAG is {RAG_STATE}")
+
+    key = (index_version(), normalize_query(query), top_k, scope)
+    cached = RESULT_CACHE.get(key)
+    if cached is not None:
+        return list(cached)
+
+    results = await _BATCHER.submit(query, top_k, scope)
+    # пустой ответ (реранкер отсёк всё) тоже кэшируется: в ключе версия
+    # индекса, после перезагрузки базы вопрос будет задан заново
+    RESULT_CACHE.set(key, results)
+
+    return list(results)
+
+
+async def aembed(query: str) -> np.ndarray:
+    """Эмбеддинг одного запроса (из кэша, если он уже считался)."""
+    if _MODEL is None:
+        raise RagNotReady("embedding model is not loaded yet")
+
+    cached = EMBEDDING_CACHE.get(normalize_query(query))
+    if cached is not None:
+        return cached
+
+    loop = asyncio.get_running_loop()
+    vectors = await loop.run_in_executor(_EXECUTOR, _encode_queries, [query])
+    return vectors[0]
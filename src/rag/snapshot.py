@@ -0,0 +1,150 @@
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from rag.ann import filtered_search_params, id_selector
+from rag.chunk_store import open_chunk_store
+from rag.scope import Scope
+
+# Сколько областей поиска держать готовыми в снимке (IDSelector по их id)
+SCOPE_CACHE_SIZE = 64
+
+
+def file_stamp(path: Path) -> Tuple[int, int]:
+    try:
+        st = path.stat()
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return 0, 0
+
+
+def files_version(*paths: Path) -> Tuple:
+    """Версия набора файлов по их mtime и размеру."""
+    return tuple(file_stamp(p) for p in paths)
+
+
+class RagSnapshot:
+    """
+    Неизменяемый снимок базы знаний: FAISS-индекс + хранилище чанков.
+
+    Поиск берёт ссылку на активный снимок один раз и работает только с ней,
+    поэтому подмена снимка (hot reload) не влияет на запросы «в полёте».
+    Старый индекс (и его mmap) освобождается, когда на него больше
+    никто не ссылается.
+    """
+
+    def __init__(self, index, store, version: Tuple):
+        self.index = index
+        self.store = store
+        self.version = version
+
+        self._selectors: Dict[Scope, Any] = {}
+        self._selectors_lock = threading.Lock()
+
+        # Снимок неизменяем — список отделов считается один раз при загрузке,
+        # а не полным проходом по хранилищу на каждый вопрос
+        self._departments: List[str] = list(store.departments())
+
+    def lookup(self, idx: int) -> Optional[Any]:
+        return self.store.get(idx)
+
+    def lookup_many(self, ids: List[int]) -> Dict[int, Any]:
+        """Чанки по id одним запросом к хранилищу."""
+        return self.store.get_many(ids)
+
+    def lexical(
+        self,
+        query: str,
+        limit: int,
+        scope: Optional[Scope] = None,
+    ) -> List[Tuple[int, float]]:
+        """BM25-кандидаты из хранилища чанков (пусто, если индекса нет)."""
+        return self.store.lexical_search(query, limit, scope)
+
+    def scope_params(self, scope: Scope, widen: int = 1):
+        """
+        Параметры FAISS-поиска по области; None — в области нет чанков.
+
+        Селектор по id области строится один раз на снимок: частые
+        области (отделы) дальше ищутся без обращения к SQLite.
+        """
+        with self._selectors_lock:
+            cached = scope in self._selectors
+            sel = self._selectors.get(scope)
+
+        if not cached:
+            ids = self.store.ids_in_scope(scope)
+            sel = id_selector(np.asarray(ids, dtype="int64")) if ids else None
+            with self._selectors_lock:
+                if len(self._selectors) >= SCOPE_CACHE_SIZE:
+                    self._selectors.clear()
+                self._selectors[scope] = sel
+
+        if sel is None:
+            return None
+        return filtered_search_params(self.index, sel, widen)
+
+    def departments(self) -> List[str]:
+        return self._departments
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+
+def read_index(index_file: Path):
+    """Загрузка FAISS индекса в режиме memory-mapped (если индекс это умеет)."""
+    try:
+        return faiss.read_index(str(index_file), faiss.IO_FLAG_MMAP)
+    except RuntimeError:
+        # не все типы индексов умеют mmap — читаем обычным образом
+        logging.warning("FAISS index does not support mmap, loading into RAM")
+        return faiss.read_index(str(index_file))
+
+
+def validate_snapshot(snap: RagSnapshot, dim: Optional[int] = None) -> None:
+    """Проверки перед тем, как отдавать снимок поиску. Бросает ValueError."""
+    index = snap.index
+
+    if len(snap) == 0:
+        raise ValueError("chunk store is empty")
+
+    if index.ntotal <= 0:
+        raise ValueError("FAISS index is empty")
+
+    expected = len(snap)
+    if index.ntotal != expected:
+        raise ValueError(
+            f"index/docs mismatch: {index.ntotal} vectors vs {expected} chunks"
+        )
+
+    if dim is not None and index.d != dim:
+        raise ValueError(f"index dim {index.d} != model dim {dim}")
+
+    # пробный поиск: индекс читается и отвечает
+    index.search(np.zeros((1, index.d), dtype="float32"), 1)
+
+
+def load_snapshot(
+    index_file: Path,
+    chunks_file: Path,
+    dim: Optional[int] = None,
+) -> RagSnapshot:
+    """Собирает и проверяет новый снимок «сбоку», не трогая активный."""
+    if not index_file.exists():
+        raise FileNotFoundError(f"FAISS index file not found: {index_file}")
+
+    if not chunks_file.exists():
+        raise FileNotFoundError(f"Chunks file not found: {chunks_file}")
+
+    version = files_version(index_file, chunks_file)
+
+    index = read_index(index_file)
+    store = open_chunk_store(chunks_file)
+
+    snap = RagSnapshot(index, store, version)
+    validate_snapshot(snap, dim)
+    return snap
@@ -0,0 +1,23 @@
+"""
+Перенос старых диалогов logs/chats/*.json в SQLite.
+
+Запуск из корня репозитория:
+    PYTHONPATH=src python -m utils.migrate_chats
+"""
+
+from pathlib import Path
+
+from utils.utils import LOG_PATH, create_initial_folders, get_store
+from utils.store import migrate_json_dir
+
+
+def main():
+    create_initial_folders()
+    chats_dir = Path(LOG_PATH) / "chats"
+
+    migrated = migrate_json_dir(get_store(), chats_dir)
+    print(f"Migrated {migrated} chats from {chats_dir}")
+
+
+if __name__ == "__main__":
+    main()
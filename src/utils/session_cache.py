@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.store import ConversationStore
+
+
+class _Entry:
+    __slots__ = ("session", "messages", "pending", "reset", "session_dirty")
+
+    def __init__(self, session: Dict[str, Any], messages: List[dict]):
+        self.session = session
+        self.messages = messages
+        # сообщения, ещё не записанные в базу
+        self.pending: List[dict] = []
+        # True — при сбросе нужно заменить историю целиком, а не дописать
+        self.reset = False
+        self.session_dirty = False
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.pending) or self.reset or self.session_dirty
+
+
+class SessionCache:
+    """
+    LRU-кэш диалогов поверх ConversationStore с отложенной записью.
+
+    Горячие чаты читаются и пишутся в памяти; изменения копятся в entry
+    и сбрасываются в SQLite фоновым flusher'ом раз в flush_interval секунд,
+    при вытеснении из кэша и при остановке бота (flush_all).
+    """
+
+    def __init__(
+        self,
+        store: ConversationStore,
+        maxsize: int = 500,
+        history_limit: int = 100,
+        flush_interval: float = 2.0,
+    ):
+        self.store = store
+        self.maxsize = max(1, maxsize)
+        self.history_limit = history_limit
+        self.flush_interval = flush_interval
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.RLock()
+        # сериализует запись в базу, чтобы дописывания не менялись местами
+        self._flush_lock = threading.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+
+    # -------------------------------------------------
+    # READ
+    # -------------------------------------------------
+
+    def is_cached(self, chat_id: str) -> bool:
+        with self._lock:
+            return chat_id in self._entries
+
+    def _get_entry(self, chat_id: str) -> _Entry:
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is not None:
+                self._entries.move_to_end(chat_id)
+                return entry
+
+        session, messages = self.store.load(chat_id, limit=self.history_limit)
+
+        evicted: List[Tuple[str, _Entry]] = []
+        with self._lock:
+            # пока читали базу, запись могла появиться из другого потока
+            entry = self._entries.get(chat_id)
+            if entry is None:
+                entry = _Entry(session, messages)
+                self._entries[chat_id] = entry
+                while len(self._entries) > self.maxsize:
+                    evicted.append(self._entries.popitem(last=False))
+
+        for old_id, old_entry in evicted:
+            try:
+                self._flush_entry(old_id, old_entry)
+            except Exception:
+                logging.exception(f"SESSION FLUSH ERROR: {old_id}")
+
+        return entry
+
+    def load(self, chat_id: str) -> Tuple[Dict[str, Any], List[dict]]:
+        entry = self._get_entry(chat_id)
+        with self._lock:
+            return dict(entry.session), list(entry.messages)
+
+    # -------------------------------------------------
+    # WRITE
+    # -------------------------------------------------
+
+    def append(self, chat_id: str, messages: List[dict]) -> None:
+        if not messages:
+            return
+        entry = self._get_entry(chat_id)
+        with self._lock:
+            entry.messages.extend(messages)
+            if len(entry.messages) > self.history_limit:
+                del entry.messages[:-self.history_limit]
+            entry.pending.extend(messages)
+        self._ensure_flusher()
+
+    def save_session(self, chat_id: str, session: Dict[str, Any]) -> None:
+        entry = self._get_entry(chat_id)
+        with self._lock:
+            entry.session = dict(session)
+            entry.session_dirty = True
+        self._ensure_flusher()
+
+    def replace(
+        self,
+        chat_id: str,
+        session: Dict[str, Any],
+        messages: List[dict],
+    ) -> None:
+        entry = self._get_entry(chat_id)
+        with self._lock:
+            entry.session = dict(session)
+            entry.messages = list(messages)
+            entry.pending = list(messages)
+            entry.reset = True
+            entry.session_dirty = True
+        self._ensure_flusher()
+
+    def compact(
+        self,
+        chat_id: str,
+        folded: List[dict],
+        head: List[dict],
+    ) -> bool:
+        """
+        Заменить сообщения folded на head (например, на резюме),
+        сохранив всё, что было дописано в чат после снимка истории.
+
+        Сообщения сравниваются по идентичности объектов из load();
+        если их уже нет в кэше (чат вытеснили и перечитали),
+        ничего не меняем и возвращаем False.
+        """
+        entry = self._get_entry(chat_id)
+        folded_ids = {id(m) for m in folded}
+
+        with self._lock:
+            remain = [m for m in entry.messages if id(m) not in folded_ids]
+            if len(entry.messages) - len(remain) != len(folded_ids):
+                return False
+
+            entry.messages = list(head) + remain
+            entry.pending = list(entry.messages)
+            entry.reset = True
+            entry.session_dirty = True
+
+        self._ensure_flusher()
+        return True
+
+    # -------------------------------------------------
+    # FLUSH
+    # -------------------------------------------------
+
+    def _flush_entry(self, chat_id: str, entry: _Entry) -> None:
+        with self._flush_lock:
+            with self._lock:
+                if not entry.dirty:
+                    return
+                pending, entry.pending = entry.pending, []
+                reset, entry.reset = entry.reset, False
+                session_dirty, entry.session_dirty = entry.session_dirty, False
+                session = dict(entry.session)
+
+            try:
+                if reset:
+                    self.store.replace(chat_id, session, pending)
+                else:
+                    self.store.append(chat_id, pending)
+                    if session_dirty:
+                        self.store.save_session(chat_id, session)
+            except Exception:
+                # вернём изменения обратно, чтобы не потерять их до следующей попытки
+                with self._lock:
+                    entry.pending = pending + entry.pending
+                    entry.reset = entry.reset or reset
+                    entry.session_dirty = entry.session_dirty or session_dirty
+                raise
+
+    def flush_all(self) -> int:
+        """Записать все грязные диалоги в базу. Возвращает их число."""
+        with self._lock:
+            dirty = [(k, e) for k, e in self._entries.items() if e.dirty]
+
+        flushed = 0
+        for chat_id, entry in dirty:
+            try:
+                self._flush_entry(chat_id, entry)
+                flushed += 1
+            except Exception:
+                logging.exception(f"SESSION FLUSH ERROR: {chat_id}")
+
+        return flushed
+
+    async def _run_flusher(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await loop.run_in_executor(None, self.flush_all)
+            except Exception:
+                logging.exception("SESSION FLUSHER ERROR")
+
+    def _ensure_flusher(self) -> None:
+        """Запускает фоновый flusher в текущем event loop (если он есть)."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # вне event loop (скрипты, миграция) — пишем сразу
+            self.flush_all()
+            return
+
+        if (
+            self._flusher is not None
+            and not self._flusher.done()
+            and self._flusher.get_loop() is loop
+        ):
+            return
+
+        self._flusher = loop.create_task(self._run_flusher())
@@ -0,0 +1,39 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+
+class StartupTimer:
+    """
+    Разбивка времени старта бота по этапам.
+
+    Отсчёт идёт от импорта модуля (main.py импортирует его первым),
+    этапы пишутся из разных потоков — поэтому под блокировкой.
+    """
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stages[name] = time.perf_counter() - start
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def report(self) -> str:
+        with self._lock:
+            parts = [f"{name}={sec:.2f}s" for name, sec in self.stages.items()]
+        parts.append(f"since_start={self.elapsed():.2f}s")
+        return " | ".join(parts)
+
+
+STARTUP = StartupTimer()
@@ -0,0 +1,235 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.tokens import TokenCounter
+
+
+# Так начинается системное сообщение с резюме прошлого диалога
+SUMMARY_PREFIX = "Резюме прошлого диалога:"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    chat_id    TEXT PRIMARY KEY,
+    data       TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id    TEXT NOT NULL,
+    role       TEXT NOT NULL,
+    content    TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    tokens     INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages (chat_id, id);
+"""
+
+
+class ConversationStore:
+    """
+    Хранилище диалогов в SQLite.
+
+    • одна строка на сообщение, запись — только дописыванием в конец;
+    • состояние сессии (state, last_rag_sources, ...) — JSON в таблице sessions;
+    • WAL-режим: чтение не блокирует запись, запись стоит O(1) от длины истории.
+
+    Одно соединение на процесс, все операции под блокировкой —
+    так конкурентные хендлеры одного чата не перетирают друг друга.
+
+    Если передан token_counter, число токенов сообщения сохраняется
+    в колонке tokens при записи и возвращается в его памятку при чтении.
+    """
+
+    def __init__(self, path: str, token_counter: Optional[TokenCounter] = None):
+        self.path = path
+        self.token_counter = token_counter
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate_schema()
+
+    def _migrate_schema(self) -> None:
+        columns = {
+            row[1] for row in self._conn.execute("PRAGMA table_info(messages)")
+        }
+        if "tokens" not in columns:
+            self._conn.execute("ALTER TABLE messages ADD COLUMN tokens INTEGER")
+
+    # -------------------------------------------------
+    # READ
+    # -------------------------------------------------
+
+    def has_chat(self, chat_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM sessions WHERE chat_id = ?",
+                (chat_id,),
+            ).fetchone()
+        return row is not None
+
+    def load(
+        self,
+        chat_id: str,
+        limit: Optional[int] = None,
+    ) -> Tuple[Dict[str, Any], List[dict]]:
+        """Состояние сессии и последние limit сообщений (по порядку)."""
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE chat_id = ?",
+                (chat_id,),
+            ).fetchone()
+
+            rows = self._conn.execute(
+                "SELECT role, content, tokens FROM ("
+                "  SELECT id, role, content, tokens FROM messages"
+                "  WHERE chat_id = ? ORDER BY id DESC LIMIT ?"
+                ") ORDER BY id",
+                (chat_id, -1 if limit is None else limit),
+            ).fetchall()
+
+        session = json.loads(row[0]) if row else {}
+        messages = []
+        for role, content, tokens in rows:
+            message = {"role": role, "content": json.loads(content)}
+            if tokens is not None and self.token_counter is not None:
+                self.token_counter.remember(message, tokens)
+            messages.append(message)
+
+        return session, messages
+
+    # -------------------------------------------------
+    # WRITE
+    # -------------------------------------------------
+
+    def _upsert_session(self, chat_id: str, session: Dict[str, Any]) -> None:
+        self._conn.execute(
+            "INSERT INTO sessions (chat_id, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET "
+            "data = excluded.data, updated_at = excluded.updated_at",
+            (chat_id, json.dumps(session, ensure_ascii=False), time.time()),
+        )
+
+    def _insert_messages(self, chat_id: str, messages: List[dict]) -> None:
+        now = time.time()
+        counter = self.token_counter
+        self._conn.executemany(
+            "INSERT INTO messages (chat_id, role, content, created_at, tokens) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    chat_id,
+                    m["role"],
+                    json.dumps(m.get("content", ""), ensure_ascii=False),
+                    now,
+                    counter.count(m) if counter is not None else None,
+                )
+                for m in messages
+            ],
+        )
+
+    def save_session(self, chat_id: str, session: Dict[str, Any]) -> None:
+        with self._lock:
+            self._upsert_session(chat_id, session)
+
+    def append(self, chat_id: str, messages: List[dict]) -> None:
+        if not messages:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._insert_messages(chat_id, messages)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def replace(
+        self,
+        chat_id: str,
+        session: Dict[str, Any],
+        messages: List[dict],
+    ) -> None:
+        """Полностью заменить историю чата (сброс, резюме, миграция)."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "DELETE FROM messages WHERE chat_id = ?",
+                    (chat_id,),
+                )
+                self._insert_messages(chat_id, messages)
+                self._upsert_session(chat_id, session)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# =====================================================
+# MIGRATION FROM JSON FILES
+# =====================================================
+
+def load_json_conversation(path: Path) -> Tuple[Dict[str, Any], List[dict]]:
+    """
+    Читает старый файл logs/chats/<chat_id>.json.
+
+    Возвращает состояние сессии и сообщения диалога. Из системных
+    сообщений остаётся только резюме: основной промпт добавляется
+    при чтении заново, а RAG-контекст нужен лишь на один ход.
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    session = {k: v for k, v in data.items() if k not in ("messages", "session")}
+    messages = [
+        {"role": m["role"], "content": m.get("content", "")}
+        for m in data.get("messages", [])
+        if isinstance(m, dict)
+        and m.get("role")
+        and (
+            m["role"] != "system"
+            or str(m.get("content", "")).startswith(SUMMARY_PREFIX)
+        )
+    ]
+    return session, messages
+
+
+def migrate_json_dir(store: ConversationStore, chats_dir: Path) -> int:
+    """Переносит все JSON-диалоги в SQLite. Уже перенесённые чаты пропускает."""
+    migrated = 0
+
+    for path in sorted(Path(chats_dir).glob("*.json")):
+        chat_id = path.stem
+        if store.has_chat(chat_id):
+            continue
+
+        try:
+            session, messages = load_json_conversation(path)
+        except Exception:
+            logging.exception(f"Failed to read {path}")
+            continue
+
+        store.replace(chat_id, session, messages)
+        migrated += 1
+
+    return migrated
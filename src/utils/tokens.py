@@ -0,0 +1,122 @@
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+
+# Служебные токены на каждое сообщение и на «затравку» ответа
+# (формат chat-моделей OpenAI)
+TOKENS_PER_MESSAGE = 3
+TOKENS_REPLY_PRIMING = 3
+
+# Кодировка по умолчанию для новых моделей (gpt-4o / gpt-4.1)
+DEFAULT_ENCODING = "o200k_base"
+
+
+def _content_key(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    return json.dumps(content, ensure_ascii=False, sort_keys=True)
+
+
+def _content_text(content: Any) -> str:
+    """Текстовая часть сообщения (для vision — только text-фрагменты)."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(
+            str(part.get("text", ""))
+            for part in content
+            if isinstance(part, dict) and part.get("type") == "text"
+        )
+    return str(content or "")
+
+
+class TokenCounter:
+    """
+    Точный подсчёт токенов через tiktoken с мемоизацией по сообщению.
+
+    Количество токенов для каждого сообщения считается один раз:
+    результат хранится в LRU-памятке и в колонке messages.tokens
+    в SQLite (см. ConversationStore), поэтому проверка бюджета
+    на каждом ходе пересчитывает только новые сообщения.
+
+    Если tiktoken или его кодировка недоступны, используется
+    старая оценка len(text) // 4.
+    """
+
+    def __init__(self, model: str, maxsize: int = 10000):
+        self.model = model
+        self.maxsize = maxsize
+
+        self._encode: Optional[Callable[[str], List[int]]] = None
+        self._encoding_loaded = False
+        self._memo: "OrderedDict[tuple, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_encoder(self) -> Optional[Callable[[str], List[int]]]:
+        if self._encoding_loaded:
+            return self._encode
+
+        self._encoding_loaded = True
+        try:
+            import tiktoken
+
+            try:
+                encoding = tiktoken.encoding_for_model(self.model)
+            except KeyError:
+                encoding = tiktoken.get_encoding(DEFAULT_ENCODING)
+
+            self._encode = encoding.encode
+        except Exception as e:
+            logging.warning(f"tiktoken is unavailable, falling back to len//4: {e}")
+            self._encode = None
+
+        return self._encode
+
+    def count_text(self, text: str) -> int:
+        encode = self._get_encoder()
+        if encode is None:
+            return len(text) // 4
+        return len(encode(text))
+
+    def _key(self, message: dict) -> tuple:
+        return message.get("role", ""), _content_key(message.get("content", ""))
+
+    def remember(self, message: dict, tokens: int) -> None:
+        """Положить уже известное число токенов (например, из базы)."""
+        key = self._key(message)
+        with self._lock:
+            self._memo[key] = tokens
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.maxsize:
+                self._memo.popitem(last=False)
+
+    def count(self, message: dict) -> int:
+        """Токены одного сообщения, включая служебные."""
+        key = self._key(message)
+        with self._lock:
+            tokens = self._memo.get(key)
+            if tokens is not None:
+                self._memo.move_to_end(key)
+                return tokens
+
+        tokens = (
+            TOKENS_PER_MESSAGE
+            + self.count_text(str(message.get("role", "")))
+            + self.count_text(_content_text(message.get("content", "")))
+        )
+        self.remember(message, tokens)
+        return tokens
+
+    def count_messages(self, messages: List[dict]) -> int:
+        if not messages:
+            return 0
+        return sum(self.count(m) for m in messages) + TOKENS_REPLY_PRIMING
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memo_size": len(self._memo),
+            "exact": self._get_encoder() is not None,
+        }
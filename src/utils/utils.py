@@ -1,6 +1,12 @@
+import atexit
 import os
-import json
 import datetime
+from pathlib import Path
+from typing import Optional
+
+from utils.store import ConversationStore, load_json_conversation
+from utils.session_cache import SessionCache
+from utils.tokens import TokenCounter
 
 
 # =====================================================
@@ -9,10 +15,22 @@ import datetime
 
 LOG_PATH = "logs"
 
+# База диалогов (SQLite, WAL)
+DB_PATH = f"{LOG_PATH}/chats.sqlite3"
+
+# Сколько последних сообщений поднимать из базы при каждом ходе
+HISTORY_LOAD_LIMIT = 100
+
+# Сколько диалогов держать в памяти и как часто сбрасывать их в базу
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "500"))
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "2"))
+
 model = "gpt-4.1-mini"
 
 max_token = 2000
 
+token_counter = TokenCounter(model)
+
 
 # =====================================================
 # BRAND SYSTEM PROMPT (Единый, усиленный)
@@ -166,41 +184,84 @@ def create_initial_folders():
     os.makedirs(f"{LOG_PATH}/chats", exist_ok=True)
 
 
+_store: Optional[ConversationStore] = None
+_sessions: Optional[SessionCache] = None
+
+
+def get_store() -> ConversationStore:
+    global _store
+    if _store is None:
+        create_initial_folders()
+        _store = ConversationStore(DB_PATH, token_counter=token_counter)
+    return _store
+
+
+def get_sessions() -> SessionCache:
+    global _sessions
+    if _sessions is None:
+        _sessions = SessionCache(
+            get_store(),
+            maxsize=SESSION_CACHE_SIZE,
+            history_limit=HISTORY_LOAD_LIMIT,
+            flush_interval=SESSION_FLUSH_INTERVAL,
+        )
+        atexit.register(flush_sessions)
+    return _sessions
+
+
+def flush_sessions() -> int:
+    """Сбросить все несохранённые диалоги в базу (при остановке бота)."""
+    if _sessions is None:
+        return 0
+    return _sessions.flush_all()
+
+
 def read_existing_conversation(chat_id: str):
     """
-    Читает историю диалога.
-    Первое сообщение всегда system: sys_mess.
+    Читает историю диалога (из памяти, при промахе — из SQLite).
+    Первое сообщение всегда system: sys_mess (в базе не хранится).
+
+    Возвращает (session, chat_key, prompt); chat_key дальше передаётся
+    в append_messages / save_session_state.
     """
 
-    create_initial_folders()
+    sessions = get_sessions()
+
+    if not sessions.is_cached(chat_id) and not get_store().has_chat(chat_id):
+        # Диалог из старого JSON-файла переносим при первом обращении
+        legacy = Path(LOG_PATH) / "chats" / f"{chat_id}.json"
+        if legacy.exists():
+            session, messages = load_json_conversation(legacy)
+            get_store().replace(chat_id, session, messages)
+
+    session, messages = sessions.load(chat_id)
+    prompt = [{"role": "system", "content": sys_mess}] + messages
+
+    return session, chat_id, prompt
+
+
+def append_messages(chat_key: str, messages: list):
+    """Дописать новые сообщения в конец истории."""
+    get_sessions().append(chat_key, messages)
+
 
-    filename = f"{LOG_PATH}/chats/{chat_id}.json"
+def save_session_state(chat_key: str, session: dict):
+    """Сохранить состояние сессии (state, last_rag_sources, ...)."""
+    get_sessions().save_session(chat_key, session)
 
-    try:
-        with open(filename, encoding="utf-8") as f:
-            data = json.load(f)
-            return data.get("session", 0), filename, data.get("messages", [])
 
-    except FileNotFoundError:
-        prompt = [{"role": "system", "content": sys_mess}]
-        session = 0
+def replace_conversation(chat_key: str, session: dict, messages: list):
+    """Заменить всю историю чата (например, на резюме)."""
+    get_sessions().replace(chat_key, session, messages)
 
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(
-                {"session": session, "messages": prompt},
-                f,
-                ensure_ascii=False,
-                indent=2
-            )
 
-        return session, filename, prompt
+def compact_conversation(chat_key: str, folded: list, head: list) -> bool:
+    """Свернуть часть истории (folded) в head, не трогая новые сообщения."""
+    return get_sessions().compact(chat_key, folded, head)
 
 
 def num_tokens_from_messages(messages: list):
     """
-    Приблизительный подсчет токенов.
+    Точный подсчет токенов (tiktoken) с памяткой по каждому сообщению.
     """
-    total = 0
-    for msg in messages:
-        total += len(str(msg.get("content", ""))) // 4
-    return total
+    return token_counter.count_messages(messages)